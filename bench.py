@@ -0,0 +1,464 @@
+#──────────────────────────────
+# ベンチマーク・負荷試験
+#   python bench.py hot  [--sizes 10,1000,10000,100000] [--repeat 30] [--json 出力先]
+#   python bench.py load [--sessions 20] [--owners 5] [--rate 0.5] [--duration 60] [--tasks 1000]
+# アプリと同じDB_*の環境変数（.env）で接続する。計測用の所有者（bench:...）の行を作って最後に消すので、
+# 本番ではなく手元のPostgreSQLで実行すること
+#──────────────────────────────
+import io
+import csv
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.pool
+import flet as ft
+from flet.core.local_connection import LocalConnection
+from flet.core.protocol import PageCommandResponsePayload, PageCommandsBatchResponsePayload
+
+import main as todo
+
+HOT_OPERATIONS = [  # 計測する操作（clear_clickedは完了タスクを消すので最後）
+    "reload_tasks_from_db", "filter_tasks", "add_clicked", "task_status_change", "on_tags_updated", "clear_clicked",
+]
+LOAD_ACTIONS = {  # 負荷試験で各セッションが行う操作とその割合
+    "add_clicked": 0.2,
+    "task_status_change": 0.3,
+    "filter_changed": 0.3,
+    "load_more_clicked": 0.1,
+    "search": 0.08,
+    "clear_clicked": 0.02,
+}
+SEARCH_WORDS = ["買", "会議", "メール", "資料", "task", "牛乳"]  # 負荷試験の検索語
+
+#──────────────────────────────
+# DBの往復回数の計測
+#──────────────────────────────
+class DbCounter:  # プロセス全体で実行したSQL文とコミットの回数を数えるクラス
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0  # execute・COPYの回数（サーバー側カーソルの追加FETCHは含まない）
+        self.commits = 0  # commit・rollbackの回数
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return self.statements + self.commits
+
+db_counter = DbCounter()
+
+class CountingCursor(todo.MeteredCursor):  # 文を実行するたびに数えるカーソル（アプリのメトリクスも記録）
+    def execute(self, query, vars=None):
+        db_counter.count("statements")
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        db_counter.count("statements")
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        db_counter.count("statements")
+        return super().copy_expert(sql, file, size)
+
+class CountingConnection(todo.MeteredConnection):  # カーソルを数える版にし、コミットも数える接続
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        db_counter.count("commits")
+        return super().commit()
+
+    def rollback(self):
+        db_counter.count("commits")
+        return super().rollback()
+
+def install_counting_pool():  # アプリの接続プールを数える版の接続で作り直す
+    todo.close_pool()
+    todo._pool = psycopg2.pool.ThreadedConnectionPool(
+        todo.DB_POOL_MIN, todo.DB_POOL_MAX, connection_factory=CountingConnection,
+        host=todo.DB_HOST, dbname=todo.DB_NAME, user=todo.DB_USER, password=todo.DB_PASSWORD, port=todo.DB_PORT
+    )
+
+#──────────────────────────────
+# ブラウザなしのページ
+#──────────────────────────────
+class HeadlessConnection(LocalConnection):  # ブラウザへ送らずにコントロールのidだけを採番するFletの接続
+    def send_command(self, session_id, command):
+        result, _ = self._process_command(command)
+        return PageCommandResponsePayload(result=result, error="")
+
+    def send_commands(self, session_id, commands):  # Fletのソケットサーバーと同じ結果を返す（送信はしない）
+        results = []
+        for command in commands:
+            result, _ = self._process_command(command)
+            if command.name in ["add", "get"]:
+                results.append(result)
+        return PageCommandsBatchResponsePayload(results=results, error="")
+
+class HeadlessRuntime:  # ft.appと同じく、イベントループ1つとスレッドプールを全セッションで共有する
+    def __init__(self, workers=32):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.thread = threading.Thread(target=self.loop.run_forever, name="bench-loop", daemon=True)
+        self.thread.start()
+        self.next_id = 0
+
+    def new_page(self):  # 新しいセッションのページを作る
+        self.next_id += 1
+        conn = HeadlessConnection()
+        page = ft.Page(conn, f"bench-{self.next_id}", self.loop, self.executor)
+        conn.sessions[page.session_id] = page
+        return page
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+def open_session(runtime, owner):  # アプリと同じ手順でセッションを開く（main()の利用者の判定だけを省く）
+    page = runtime.new_page()
+    page.title = "ToDoリスト"
+    page.scroll = ft.ScrollMode.ADAPTIVE
+    app = todo.start_session(page, owner)
+    if not app.loaded.wait(60):  # 最初のページが表示されるまで待つ（読み込みは別スレッド）
+        raise RuntimeError(f"{owner}: 初期読み込みが終わりませんでした")
+    return app
+
+def close_session(app):  # セッション終了（購読をやめる）
+    if app.page.on_close:
+        app.page.on_close(None)
+
+#──────────────────────────────
+# 計測用のデータ
+#──────────────────────────────
+def seed_owner(size):  # 計測用の所有者を作り、size件のタスクを一括インポートする
+    owner = f"bench:{size}:{random.getrandbits(48):012x}"
+    tags = [name for _, name in todo.load_tags_from_db(owner)] + [""]  # 空欄は「その他」
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["name", "completed", "tag"])
+    for i in range(size):
+        writer.writerow([f"タスク{i} {random.choice(SEARCH_WORDS)}", random.random() < 0.3, tags[i % len(tags)]])
+    buf.seek(0)
+    todo.import_tasks(buf, "csv", owner=owner)
+    return owner
+
+def drop_owner(owner):  # 計測用の所有者の行を消す（1行ごとの変更通知は出さない）
+    with todo.db_cursor() as cur:
+        cur.execute("SELECT set_config('todo.bulk', 'on', true)")
+        cur.execute("DELETE FROM todos WHERE owner = %s", (owner,))
+        cur.execute("DELETE FROM tags WHERE owner = %s", (owner,))
+    todo.query_cache.invalidate(owner)  # 変更通知を出していないので読み取りキャッシュは自分で消す
+
+#──────────────────────────────
+# 集計
+#──────────────────────────────
+def percentile(values, p):  # 最近傍順位法のパーセンタイル
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def ui_totals(apps):  # セッションのUiMeterの累計（メッセージ数・バイト数・コントロール数）
+    total = {"messages": 0, "bytes": 0, "controls": 0}
+    for app in apps:
+        for entry in app.meter.stats.values():
+            for k in total:
+                total[k] += entry[k]
+    return total
+
+def summarize(latencies, **extra):  # 遅延（秒）の一覧を集計結果にまとめる
+    result = {
+        "n": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0) * 1000,
+    }
+    result.update(extra)
+    return result
+
+#──────────────────────────────
+# ホットパスの計測
+#──────────────────────────────
+class HotBench:  # 1つの所有者・1セッションに対して各操作を繰り返し計測するクラス
+    def __init__(self, app):
+        self.app = app
+        self.i = 0
+
+    def prepare(self, name):  # 計測しない準備（操作の入力を用意する）。操作を返す（できなければNone）
+        app = self.app
+        self.i += 1
+        if name == "reload_tasks_from_db":
+            return self.reload
+        if name == "filter_tasks":
+            app.status_tabs.selected_index = self.i % 2  # アクティブ/完了を交互に切り替える
+            return lambda: app.filter_changed(None)
+        if name == "add_clicked":
+            app.new_task.value = f"ベンチ {self.i}"
+            return lambda: app.add_clicked(None)
+        if name == "task_status_change":
+            if not app.visible_tasks:
+                return None
+            task = app.visible_tasks[self.i % len(app.visible_tasks)]
+            task.completed = not task.completed
+            return lambda: app.task_status_change(task)
+        if name == "on_tags_updated":
+            suffix = "・" if self.i % 2 else ""
+            new_tags = [[tag_id, tag_name.rstrip("・") + suffix] for tag_id, tag_name in app.tags if tag_id is not None]
+            return lambda: app.on_tags_updated(new_tags)
+        if name == "clear_clicked":
+            active = app.store.filter(todo.ANY_TAG, False)
+            if active:  # 毎回1件は完了タスクがあるようにする
+                active[0].completed = True
+                app.task_status_change(active[0])
+                todo.write_behind.drain()
+            return lambda: app.clear_clicked(None)
+        raise ValueError(name)
+
+    def reload(self):  # reload_tasks_from_dbはハンドラーではないので、ここで操作として計測する
+        with self.app.meter.interaction("reload_tasks_from_db"):
+            self.app.reload_tasks_from_db()
+
+    def run(self, name, repeat):  # 遅延・DB往復・UI送信量を計測し、最後に1回だけメモリ確保量を計測する
+        latencies, db, ui = [], 0, {"messages": 0, "bytes": 0, "controls": 0}
+        for _ in range(repeat):
+            op = self.prepare(name)
+            if op is None:
+                continue
+            todo.write_behind.drain()
+            db_before, ui_before = db_counter.snapshot(), ui_totals([self.app])
+            started = time.perf_counter()
+            op()
+            latencies.append(time.perf_counter() - started)
+            todo.write_behind.drain()  # 操作の後でバックグラウンドに回した保存も往復回数に含める
+            db += db_counter.snapshot() - db_before
+            ui_after = ui_totals([self.app])
+            for k in ui:
+                ui[k] += ui_after[k] - ui_before[k]
+        n = max(1, len(latencies))
+        alloc = self.measure_allocations(name)
+        return summarize(
+            latencies,
+            db_round_trips=db / n,
+            ui_messages=ui["messages"] / n,
+            ui_bytes=ui["bytes"] / n,
+            ui_controls=ui["controls"] / n,
+            **alloc
+        )
+
+    def measure_allocations(self, name):  # tracemallocで1回分のメモリ確保量を計測（遅延の計測とは分ける）
+        op = self.prepare(name)
+        if op is None:
+            return {"alloc_peak_kib": 0.0, "alloc_retained_kib": 0.0}
+        todo.write_behind.drain()
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            op()
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        todo.write_behind.drain()
+        return {"alloc_peak_kib": (peak - before) / 1024, "alloc_retained_kib": (after - before) / 1024}
+
+def run_hot(args):
+    results = []
+    runtime = HeadlessRuntime()
+    try:
+        for size in args.sizes:
+            print(f"== {size}件: データ投入中...", file=sys.stderr)
+            owner = seed_owner(size)
+            try:
+                tracemalloc.start()
+                started = time.perf_counter()
+                app = open_session(runtime, owner)
+                session_seconds = time.perf_counter() - started
+                session_kib = tracemalloc.get_traced_memory()[0] / 1024
+                tracemalloc.stop()
+                print(f"   セッション開始 {session_seconds * 1000:.1f}ms / {session_kib:.0f}KiB", file=sys.stderr)
+                bench = HotBench(app)
+                for name in HOT_OPERATIONS:
+                    result = bench.run(name, args.repeat)
+                    result.update(size=size, operation=name)
+                    results.append(result)
+                    print_row(result)
+                close_session(app)
+            finally:
+                todo.write_behind.drain()
+                drop_owner(owner)
+    finally:
+        runtime.close()
+    return results
+
+def print_row(r):
+    print(
+        f"{r['size']:>7} {r['operation']:<22} n={r['n']:<4} "
+        f"p50={r['p50_ms']:8.2f}ms p90={r['p90_ms']:8.2f}ms p99={r['p99_ms']:8.2f}ms max={r['max_ms']:8.2f}ms "
+        f"db={r['db_round_trips']:6.1f} ui={r['ui_messages']:4.1f}msg/{r['ui_bytes']:8.0f}B/{r['ui_controls']:6.1f}ctl "
+        f"alloc={r['alloc_peak_kib']:8.1f}KiB(残{r['alloc_retained_kib']:7.1f})"
+    )
+
+#──────────────────────────────
+# 複数セッションの負荷試験
+#──────────────────────────────
+class LoadSession:  # 1つのブラウザセッションとして、ランダムな間隔で操作を繰り返すクラス
+    def __init__(self, app, rate, recorder, rng):
+        self.app = app
+        self.rate = rate  # 1秒あたりの平均操作回数
+        self.recorder = recorder
+        self.rng = rng
+        self.actions = list(LOAD_ACTIONS)
+        self.weights = [LOAD_ACTIONS[a] for a in self.actions]
+
+    def act(self, name):  # 操作を1回行う
+        app = self.app
+        if name == "add_clicked":
+            app.new_task.value = f"負荷 {self.rng.random():.6f}"
+            app.add_clicked(None)
+        elif name == "task_status_change":
+            if app.visible_tasks:
+                task = self.rng.choice(app.visible_tasks)
+                task.completed = not task.completed
+                app.task_status_change(task)
+        elif name == "filter_changed":
+            app.tag_tabs.selected_index = self.rng.randrange(max(1, len(app.tags)))
+            app.status_tabs.selected_index = self.rng.randrange(2)
+            app.filter_changed(None)
+        elif name == "load_more_clicked":
+            app.load_more_clicked(None)
+        elif name == "search":  # 検索して、結果を見たら通常の一覧に戻る
+            for query in (self.rng.choice(SEARCH_WORDS), ""):
+                app.search_box.value = query
+                app.search_seq += 1
+                app.run_search(app.search_seq)
+        elif name == "clear_clicked":
+            app.clear_clicked(None)
+
+    def run(self, deadline):
+        while True:
+            wait = self.rng.expovariate(self.rate)  # 操作の間隔は指数分布（平均1/rate秒）
+            if time.monotonic() + wait >= deadline:
+                break
+            time.sleep(wait)
+            name = self.rng.choices(self.actions, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                self.act(name)
+            except Exception as ex:
+                self.recorder.error(name, ex)
+            else:
+                self.recorder.record(name, time.perf_counter() - started)
+
+class LoadRecorder:  # 全セッションの操作の遅延を集めるクラス
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name, ex):
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        todo.logger.warning("%s に失敗しました: %s", name, ex)
+
+def run_load(args):
+    runtime = HeadlessRuntime(workers=max(32, args.sessions * 2))
+    owners = [seed_owner(args.tasks) for _ in range(args.owners)]  # 同じ所有者の複数セッションは変更通知で同期される
+    apps = []
+    try:
+        print(f"== {args.sessions}セッション / {args.owners}利用者 / 各{args.rate}回/秒 / {args.duration}秒", file=sys.stderr)
+        for i in range(args.sessions):
+            apps.append(open_session(runtime, owners[i % len(owners)]))
+        recorder = LoadRecorder()
+        rng = random.Random(args.seed)
+        sessions = [LoadSession(app, args.rate, recorder, random.Random(rng.random())) for app in apps]
+        ui_before, db_before = ui_totals(apps), db_counter.snapshot()
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=s.run, args=(deadline,), daemon=True) for s in sessions]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        todo.write_behind.drain()
+        elapsed = time.perf_counter() - started
+        ui_after = ui_totals(apps)
+        results = []
+        total = sum(len(v) for v in recorder.latencies.values())
+        for name in LOAD_ACTIONS:
+            r = summarize(recorder.latencies.get(name, []), operation=name, errors=recorder.errors.get(name, 0))
+            results.append(r)
+            print(
+                f"{name:<20} n={r['n']:<6} p50={r['p50_ms']:8.2f}ms p90={r['p90_ms']:8.2f}ms "
+                f"p99={r['p99_ms']:8.2f}ms max={r['max_ms']:8.2f}ms errors={r['errors']}"
+            )
+        summary = {
+            "sessions": args.sessions,
+            "owners": args.owners,
+            "throughput_per_s": total / elapsed if elapsed else 0.0,
+            "db_round_trips": db_counter.snapshot() - db_before,
+            "ui": {k: ui_after[k] - ui_before[k] for k in ui_after},
+        }
+        print(
+            f"合計 {total}操作 {summary['throughput_per_s']:.1f}操作/秒 DB往復 {summary['db_round_trips']} "
+            f"UI {summary['ui']['messages']}msg/{summary['ui']['bytes']}B"
+        )
+        return {"operations": results, "summary": summary}
+    finally:
+        for app in apps:
+            close_session(app)
+        todo.write_behind.drain()
+        for owner in owners:
+            drop_owner(owner)
+        runtime.close()
+
+#──────────────────────────────
+# コマンドライン
+#──────────────────────────────
+def run_bench_cli(argv=None):
+    parser = argparse.ArgumentParser(description="タグ付きToDoリストのベンチマーク・負荷試験")
+    parser.add_argument("--json", help="結果をJSONで書き出すファイル")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_hot = sub.add_parser("hot", help="1セッションの各操作の遅延・DB往復・UI送信量・メモリ確保量を件数別に計測")
+    p_hot.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[10, 1000, 10000, 100000],
+                       help="タスク件数（カンマ区切り）")
+    p_hot.add_argument("--repeat", type=int, default=30, help="操作ごとの繰り返し回数")
+
+    p_load = sub.add_parser("load", help="複数セッションが同時に操作する負荷をかける")
+    p_load.add_argument("--sessions", type=int, default=20, help="同時セッション数")
+    p_load.add_argument("--owners", type=int, default=5, help="利用者数（セッションは利用者に順に割り当てる）")
+    p_load.add_argument("--rate", type=float, default=0.5, help="1セッションあたりの平均操作回数（回/秒）")
+    p_load.add_argument("--duration", type=float, default=60, help="負荷をかける秒数")
+    p_load.add_argument("--tasks", type=int, default=1000, help="利用者ごとのタスク件数")
+    p_load.add_argument("--seed", type=int, default=1, help="乱数の種")
+
+    args = parser.parse_args(argv)
+    todo.ensure_schema()
+    install_counting_pool()
+    try:
+        results = run_hot(args) if args.command == "hot" else run_load(args)
+    finally:
+        todo.write_behind.drain()
+        todo.close_pool()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    run_bench_cli()
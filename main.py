@@ -1,5 +1,23 @@
 import os  # 環境変数を扱うための標準ライブラリ
+import sys  # 標準入出力（一括入出力コマンド用）
+import csv  # CSV形式の読み書き
+import json  # JSON Lines形式の読み書き
+import argparse  # コマンドライン引数の解析
+import logging  # 動作ログの出力
+import select  # 変更通知（LISTEN）の受信待ち
+import uuid  # セッションごとの識別子
+import re  # ブラウザに保存した識別子の形式チェック
+import time  # 接続の最終利用時刻の記録用
+import threading  # 接続プールの排他制御用
+import cProfile  # 指定した操作のプロファイル（PROFILEで有効化）
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # メトリクスの公開用
+from contextlib import contextmanager  # with文で使う関数を作るためのデコレータ
+from collections import OrderedDict  # 読み取りキャッシュの使用順の管理
+from concurrent.futures import Future  # 同時に来た同じ問い合わせの結果待ち
 import psycopg2  # PostgreSQLとの接続に使うライブラリ
+import psycopg2.pool  # 接続プール
+import psycopg2.extras  # execute_values（複数行を1回で送信）
+import psycopg2.extensions  # 計測用の接続・カーソル
 import flet as ft  # Flet UI ライブラリをftという名前でインポート
 from datetime import datetime  # 日付・時間の操作用
 
@@ -8,99 +26,1387 @@ from flet import (
     Icons, Colors, Text, Row, Column, ElevatedButton,
     TextField, Tabs, Tab, AlertDialog, OutlinedButton, IconButton, Container
 )
+from flet.core.protocol import CommandEncoder  # Fletクライアントへ送るコマンドのJSON化（送信量の計測用）
 from dotenv import load_dotenv  # .envファイルから環境変数を読み込むライブラリ
 
 load_dotenv()  # .envファイルから環境変数を読み込み
 
+logger = logging.getLogger("todo")  # アプリ共通のロガー
+
 # 環境変数からDB接続情報を取得
 DB_HOST = os.getenv("DB_HOST")  # ホスト名
 DB_NAME = os.getenv("DB_NAME")  # データベース名
 DB_USER = os.getenv("DB_USER")  # ユーザー名
 DB_PASSWORD = os.getenv("DB_PASSWORD")  # パスワード
+DB_PORT = int(os.getenv("DB_PORT", 5432))  # ポート番号
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))  # プールに常に確保しておく接続数
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))  # プール全体の最大接続数（全セッション共通）
+BULK_PAGE_SIZE = int(os.getenv("BULK_PAGE_SIZE", 1000))  # execute_valuesで1文にまとめる行数
+WRITE_BEHIND_DELAY = float(os.getenv("WRITE_BEHIND_DELAY", 0.3))  # 変更をまとめて保存するまでの待ち時間（秒）
+WRITE_BEHIND_MAX_RETRY = float(os.getenv("WRITE_BEHIND_MAX_RETRY", 30))  # 保存失敗時の再試行間隔の上限（秒）
+DB_POOL_CHECK_INTERVAL = float(os.getenv("DB_POOL_CHECK_INTERVAL", 30))  # この秒数以上使われていない接続は貸し出し前に生存確認する
+LEGACY_OWNER = os.getenv("LEGACY_OWNER")  # 所有者の無い旧データ（owner=''）を引き継ぐ利用者（例: user:123、browser:...）。起動時に移す
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # アプリのログ（ロガー「todo」）を出すレベル（DEBUG/INFO/WARNING/ERROR）
+UI_METER_LOG = os.getenv("UI_METER_LOG", "") not in ("", "0")  # 操作ごとのUI送信量をログに出すかどうか
+TASK_PAGE_SIZE = int(os.getenv("TASK_PAGE_SIZE", 50))  # 一度に画面へ出すタスク数（残りは「もっと見る」・スクロールで追加）
+LOAD_CHUNK_SIZE = int(os.getenv("LOAD_CHUNK_SIZE", 10))  # 起動時に少しずつ読み込んで表示する件数（先に画面を出して続きを順に描く）
+SEARCH_DEBOUNCE = float(os.getenv("SEARCH_DEBOUNCE", 0.3))  # 入力が止まってから検索するまでの待ち時間（秒）
+QUERY_CACHE_MB = float(os.getenv("QUERY_CACHE_MB", 64))  # 全セッションで共有する問い合わせ結果のキャッシュの上限（MB、0なら使わない）
+
+APP_PORT = int(os.getenv("PORT", 8550))  # Fletアプリのポート
+METRICS_PORT = int(os.getenv("METRICS_PORT", APP_PORT + 1))  # メトリクスを公開するポート（0なら公開しない）
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # メトリクスを公開するアドレス（既定はローカルのみ）
+SLOW_OP_MS = float(os.getenv("SLOW_OP_MS", 0))  # この時間（ミリ秒）以上かかった操作をJSONでログに出す（0なら出さない）
+PROFILE = {name for name in os.getenv("PROFILE", "").split(",") if name}  # cProfileで計測する操作名（*なら全部）
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")  # プロファイル結果（.prof）の出力先
+
+CHANGE_CHANNEL = "todos_changes"  # todosの変更を通知するNOTIFYチャンネル名
+ANY_TAG = "*"  # 「タグで絞り込まない」を表す値（タグidのNoneは「その他」＝タグ無しを表す）
 
 # デフォルトで使用するタグ一覧
 DEFAULT_TAGS = ["仕事", "プライベート", "買い物"]
 
-# PostgreSQLへの接続を返す関数
+#──────────────────────────────
+# メトリクス（Prometheusのテキスト形式で公開）
+#──────────────────────────────
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 処理時間（秒）の区切り
+CONTROL_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)  # 1回の送信のコントロール数の区切り
+
+class Metrics:  # カウンター・ゲージ・ヒストグラムを集計し、Prometheusのテキスト形式で出力するクラス（プロセスで1つ）
+    def __init__(self):
+        self.lock = threading.Lock()  # 集計値の排他
+        self.families = {}  # 名前 -> (種類, 説明, ヒストグラムの区切り)
+        self.values = {}  # 名前 -> {ラベルの組: 値（ヒストグラムは [区切りごとの件数..., 合計, 件数]）}
+        self.callbacks = {}  # 名前 -> 出力時に値を読む関数（ゲージ）
+        self.local = threading.local()  # スレッドごとのDB問い合わせ回数・時間（遅い操作のログ用）
+
+    def describe(self, name, kind, help_text, buckets=None):  # メトリクスを登録
+        self.families[name] = (kind, help_text, buckets)
+        self.values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):  # カウンター・ゲージに加算（ゲージは負の値も可）
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):  # ヒストグラムに1件記録
+        buckets = self.families[name][2]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def gauge(self, name, help_text, callback):  # 出力のたびに関数で値を読むゲージを登録
+        self.describe(name, "gauge", help_text)
+        self.callbacks[name] = callback
+
+    def thread_stats(self):  # このスレッドのDB問い合わせ回数と合計時間
+        return getattr(self.local, "db_queries", 0), getattr(self.local, "db_seconds", 0.0)
+
+    def count_query(self, seconds):  # このスレッドのDB問い合わせを数える
+        self.local.db_queries = getattr(self.local, "db_queries", 0) + 1
+        self.local.db_seconds = getattr(self.local, "db_seconds", 0.0) + seconds
+
+    @staticmethod
+    def _labels(key, extra=()):  # ラベルを {a="1",b="2"} の形にする
+        items = list(key) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in items) + "}"
+
+    def render(self):  # Prometheusのテキスト形式で全メトリクスを出力
+        for name, callback in self.callbacks.items():
+            try:
+                value = callback()
+            except Exception:
+                logger.exception("メトリクス %s の取得に失敗しました", name)
+                continue
+            with self.lock:
+                self.values[name] = {(): value}
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in self.families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self.values[name].items():
+                    if kind != "histogram":
+                        lines.append(f"{name}{self._labels(key)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets, value):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{self._labels(key, [('le', '+Inf')])} {value[-1]}")
+                    lines.append(f"{name}_sum{self._labels(key)} {value[-2]}")
+                    lines.append(f"{name}_count{self._labels(key)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+def _label_value(value):  # ラベルの値をエスケープ
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+metrics = Metrics()  # プロセス共通のメトリクス
+metrics.describe("todo_handler_seconds", "histogram", "UI操作（イベントハンドラー）の処理時間（秒）", LATENCY_BUCKETS)
+metrics.describe("todo_ui_update_seconds", "histogram", "まとめた変更をFletへ送るpage.update()の時間（秒）", LATENCY_BUCKETS)
+metrics.describe("todo_ui_update_controls", "histogram", "1回の送信で追加・変更・削除されたコントロール数", CONTROL_BUCKETS)
+metrics.describe("todo_ui_sent_bytes_total", "counter", "Fletクライアントへ送ったバイト数")
+metrics.describe("todo_db_query_seconds", "histogram", "SQL文1回の実行時間（秒）", LATENCY_BUCKETS)
+metrics.describe("todo_db_query_errors_total", "counter", "エラーになったSQL文の数")
+metrics.describe("todo_db_connection_wait_seconds", "histogram", "プールから接続を借りるまでの待ち時間（秒）", LATENCY_BUCKETS)
+metrics.describe("todo_db_connections_opened_total", "counter", "新しく開いたDB接続の数")
+metrics.describe("todo_db_connections_discarded_total", "counter", "切断されていて捨てたDB接続の数")
+metrics.describe("todo_db_connections_in_use", "gauge", "貸し出し中のプールの接続数")
+metrics.describe("todo_write_behind_seconds", "histogram", "1セッション分の変更の保存時間（秒）", LATENCY_BUCKETS)
+metrics.describe("todo_write_behind_failures_total", "counter", "変更の保存に失敗した回数")
+metrics.describe("todo_change_events_total", "counter", "受け取った変更通知の数")
+metrics.describe("todo_query_cache_requests_total", "counter", "読み取りキャッシュへの問い合わせ数（hit・miss・wait＝他のセッションの読み込み待ち）")
+metrics.describe("todo_query_cache_evictions_total", "counter", "上限を超えて読み取りキャッシュから捨てた結果の数")
+metrics.inc("todo_db_connections_in_use", 0)
+
+SQL_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "COPY", "CREATE", "ALTER", "DROP", "LISTEN", "SAVEPOINT", "RELEASE", "ROLLBACK"}
+
+def _statement_kind(query):  # SQL文の種類（メトリクスのラベル用。種類を増やしすぎないように既知のものだけ）
+    if isinstance(query, bytes):
+        query = query[:16].decode("ascii", "ignore")
+    word = str(query).lstrip().split(None, 1)[0].upper() if str(query).strip() else ""
+    return word if word in SQL_KINDS else "OTHER"
+
+@contextmanager
+def _timed_query(query):  # SQL文1回の実行時間を記録
+    started = time.perf_counter()
+    try:
+        yield
+    except psycopg2.Error:
+        metrics.inc("todo_db_query_errors_total", statement=_statement_kind(query))
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("todo_db_query_seconds", elapsed, statement=_statement_kind(query))
+        metrics.count_query(elapsed)
+
+class MeteredCursor(psycopg2.extensions.cursor):  # 実行したSQL文の回数と時間を記録するカーソル
+    def execute(self, query, vars=None):
+        with _timed_query(query):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with _timed_query(query):
+            return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        with _timed_query(sql):
+            return super().copy_expert(sql, file, size)
+
+class MeteredConnection(psycopg2.extensions.connection):  # 開いた接続を数え、カーソルをMeteredCursorにする接続
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = MeteredCursor
+        metrics.inc("todo_db_connections_opened_total")
+
+class _MetricsHandler(BaseHTTPRequestHandler):  # /metrics だけに応答するHTTPハンドラー
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # アクセスログは出さない
+        pass
+
+_profile_lock = threading.Lock()  # プロファイラーは同時に1つだけ動かす
+
+def start_profile(name):  # PROFILEで指定された操作ならcProfileを開始して返す（それ以外・他で計測中ならNone）
+    if not PROFILE or ("*" not in PROFILE and name not in PROFILE):
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # 他のプロファイラーが動いている
+        _profile_lock.release()
+        return None
+    return profiler
+
+def stop_profile(profiler, name):  # プロファイルを止めてPROFILE_DIRに.profとして保存
+    try:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.prof")
+        profiler.dump_stats(path)
+        logger.info("プロファイルを %s に保存しました", path)
+    except OSError as ex:
+        logger.warning("プロファイルを保存できませんでした: %s", ex)
+    finally:
+        _profile_lock.release()
+
+def start_metrics_server(port, host=None):  # メトリクスのHTTPサーバーをバックグラウンドで起動
+    server = ThreadingHTTPServer((host or METRICS_HOST, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("メトリクスを http://%s:%d/metrics で公開しています", host or METRICS_HOST, port)
+    return server
+
+# PostgreSQLへの新しい接続を返す関数（通常はプール経由のdb_connection()を使う）
 def get_conn():
     return psycopg2.connect(
+        connection_factory=MeteredConnection,  # SQL文の回数・時間を記録
         host=DB_HOST,
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
-        port=5432
+        port=DB_PORT
     )
 
-# タスクリストをDBに保存する関数
-def save_tasks_to_db(tasks):
-    conn = get_conn()  # DB接続
-    cur = conn.cursor()  # カーソル作成
-    cur.execute("DELETE FROM todos")  # 既存タスクを全削除
-    for t in tasks:
+#──────────────────────────────
+# 接続プール（プロセス全体で共有）
+#──────────────────────────────
+_pool = None  # ThreadedConnectionPool（最初の利用時に作成）
+_search_method = "like"  # 検索に使う方式（ensure_schemaで使える拡張機能に合わせて"bigm"/"trgm"に切り替える）
+_pool_lock = threading.Lock()  # プール作成時の排他用
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)  # 貸し出し中の接続数を制限（満杯なら空くまで待つ）
+_last_used = {}  # 接続 -> 最後に返却された時刻
+
+def get_pool():  # プロセス共通の接続プールを返す（無ければ作成）
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, connection_factory=MeteredConnection,
+                    host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT
+                )
+    return _pool
+
+def close_pool():  # プールの全接続を閉じる（プロセス終了時など）
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+def _is_healthy(conn):  # 貸し出し前の接続チェック（しばらく使っていない接続だけSELECT 1で確認）
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(conn, 0) < DB_POOL_CHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()  # 確認用のトランザクションを終了
+        return True
+    except psycopg2.Error:
+        return False
+
+def _discard(pool, conn):  # 壊れた接続をプールから外して閉じる
+    _last_used.pop(conn, None)
+    metrics.inc("todo_db_connections_discarded_total")
+    try:
+        pool.putconn(conn, close=True)
+    except psycopg2.pool.PoolError:
+        pass
+
+# プールから接続を借りるコンテキストマネージャ（正常終了でcommit、例外でrollback）
+@contextmanager
+def db_connection():
+    pool = get_pool()
+    started = time.perf_counter()
+    _pool_slots.acquire()  # 上限に達していれば返却を待つ
+    metrics.inc("todo_db_connections_in_use")
+    conn = None
+    try:
+        conn = pool.getconn()
+        for _ in range(DB_POOL_MAX):  # 切断された接続は捨てて取り直す
+            if _is_healthy(conn):
+                break
+            _discard(pool, conn)
+            conn = pool.getconn()
+        metrics.observe("todo_db_connection_wait_seconds", time.perf_counter() - started)  # 待ち・接続・生存確認の時間
+        try:
+            yield conn
+            conn.commit()  # コミットして反映
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            _discard(pool, conn)  # 接続が切れた場合は次回再接続させる
+            conn = None
+            raise
+        except BaseException:
+            conn.rollback()  # 途中までの変更を取り消す
+            raise
+    finally:
+        if conn is not None:
+            _last_used[conn] = time.monotonic()
+            pool.putconn(conn)  # プールに返却
+        metrics.inc("todo_db_connections_in_use", -1)
+        _pool_slots.release()
+
+# プールの接続からカーソルを作って渡すコンテキストマネージャ
+@contextmanager
+def db_cursor():
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+# todos・tagsテーブルを用意する関数（旧形式のテーブルは列の追加・移行を行う）
+def ensure_schema():
+    with db_cursor() as cur:  # プールから接続を借りる
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS tags ("
+            "id SERIAL PRIMARY KEY, owner TEXT NOT NULL DEFAULT '', name TEXT NOT NULL, "
+            "position INTEGER NOT NULL DEFAULT 0, UNIQUE (owner, name))"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS todos ("
+            "id SERIAL PRIMARY KEY, owner TEXT NOT NULL DEFAULT '', name TEXT NOT NULL, "
+            "completed BOOLEAN NOT NULL DEFAULT FALSE, created_at TEXT, updated_at TEXT, "
+            "tag_id INTEGER REFERENCES tags (id) ON DELETE SET NULL)"  # タグが消えたタスクは「その他」（NULL）になる
+        )
+        # ALTER TABLEは何もしなくても排他ロックを取るので、旧テーブルに列が無いときだけ実行する
+        if not _has_column(cur, "todos", "id"):
+            cur.execute("ALTER TABLE todos ADD COLUMN id SERIAL PRIMARY KEY")  # 旧テーブルに主キーを追加
+        if not _has_column(cur, "todos", "owner"):
+            cur.execute("ALTER TABLE todos ADD COLUMN owner TEXT NOT NULL DEFAULT ''")  # 所有者（既存の行は共有の''）
+        if not _has_column(cur, "todos", "tag_id"):
+            cur.execute("ALTER TABLE todos ADD COLUMN tag_id INTEGER REFERENCES tags (id) ON DELETE SET NULL")
+        if _has_column(cur, "todos", "tag"):  # タグ名を直接持っていた旧形式からtagsテーブルへ移行
+            cur.execute(
+                "INSERT INTO tags (owner, name) SELECT DISTINCT owner, tag FROM todos "
+                "WHERE tag IS NOT NULL AND tag <> 'その他' ON CONFLICT (owner, name) DO NOTHING"
+            )
+            cur.execute("UPDATE todos SET tag_id = g.id FROM tags g WHERE g.owner = todos.owner AND g.name = todos.tag")
+            cur.execute("ALTER TABLE todos DROP COLUMN tag")  # タグ名の列と、それを使う旧索引を削除
+        if LEGACY_OWNER:
+            claim_legacy_rows(cur, LEGACY_OWNER)
+        cur.execute("DROP INDEX IF EXISTS todos_completed_id_idx")  # 所有者を含まない旧索引
+        _create_index(cur, "todos_owner_tag_id_completed_id_idx", "todos (owner, tag_id, completed, id)")  # タグ・状態別のページ取得用
+        _create_index(cur, "todos_owner_completed_id_idx", "todos (owner, completed, id)")  # タグ指定なしのページ取得用
+        _create_index(cur, "todos_tag_id_idx", "todos (tag_id)")  # タグ削除時のON DELETE SET NULL用
+        ensure_search_index(cur)
+        # 行の変更をNOTIFYで配信するトリガー（todo.originで変更元のセッションを、todo.bulkで一括処理中かを伝える）
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION todos_notify() RETURNS trigger AS $$
+            DECLARE
+                r RECORD;
+                payload TEXT;
+            BEGIN
+                IF current_setting('todo.bulk', true) = 'on' THEN
+                    RETURN NULL;  -- 一括処理は最後にRESYNCを1回だけ送る
+                END IF;
+                IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+                payload := json_build_object('op', TG_OP, 'origin', current_setting('todo.origin', true), 'row', row_to_json(r))::text;
+                IF octet_length(payload) > 7900 THEN  -- NOTIFYの上限（8000バイト）を超えるときはidだけ送る
+                    payload := json_build_object('op', TG_OP, 'origin', current_setting('todo.origin', true), 'id', r.id, 'owner', r.owner)::text;
+                END IF;
+                PERFORM pg_notify('{CHANGE_CHANNEL}', payload);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        if not _has_trigger(cur, "todos", "todos_notify"):  # 作り直すと排他ロックを取るので、無いときだけ作る（関数の中身は上で置き換わる）
+            cur.execute("CREATE TRIGGER todos_notify AFTER INSERT OR UPDATE OR DELETE ON todos FOR EACH ROW EXECUTE FUNCTION todos_notify()")
+        # タグ一覧の変更を通知するトリガー（受け取ったセッションはタグ一覧を読み直す）
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION tags_notify() RETURNS trigger AS $$
+            DECLARE
+                r RECORD;
+            BEGIN
+                IF current_setting('todo.bulk', true) = 'on' THEN
+                    RETURN NULL;
+                END IF;
+                IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF;
+                PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                    'op', 'TAGS', 'origin', current_setting('todo.origin', true), 'owner', r.owner)::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        if not _has_trigger(cur, "tags", "tags_notify"):
+            cur.execute("CREATE TRIGGER tags_notify AFTER INSERT OR UPDATE OR DELETE ON tags FOR EACH ROW EXECUTE FUNCTION tags_notify()")
+
+# テーブルに列があるかを返す関数
+def _has_column(cur, table, column):
+    cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s", (table, column))
+    return cur.fetchone() is not None
+
+# テーブルにトリガーがあるかを返す関数
+def _has_trigger(cur, table, name):
+    cur.execute("SELECT 1 FROM pg_trigger WHERE tgrelid = %s::regclass AND tgname = %s", (table, name))
+    return cur.fetchone() is not None
+
+# 索引が無いときだけ作る関数（CREATE INDEX IF NOT EXISTSでも、あるかを調べる前にテーブルの書き込みを止めるロックを取るため）
+def _create_index(cur, name, target):  # target: 「テーブル (列, ...)」の部分
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    if cur.fetchone()[0] is None:
+        cur.execute(f"CREATE INDEX {name} ON {target}")
+
+# 所有者の無い旧データ（owner=''）のタスクとタグを指定した利用者のものにする関数（どのセッションも''にはならないため）
+def claim_legacy_rows(cur, owner):
+    cur.execute("SELECT set_config('todo.bulk', 'on', true)")  # 1行ごとの変更通知を止める
+    cur.execute(  # 同じ名前のタグを既に持っていれば、そのタグに付け替える
+        "UPDATE todos SET tag_id = mine.id FROM tags legacy JOIN tags mine ON mine.owner = %s AND mine.name = legacy.name "
+        "WHERE legacy.owner = '' AND todos.tag_id = legacy.id",
+        (owner,)
+    )
+    cur.execute(
+        "DELETE FROM tags legacy USING tags mine WHERE legacy.owner = '' AND mine.owner = %s AND mine.name = legacy.name",
+        (owner,)
+    )
+    cur.execute("UPDATE tags SET owner = %s WHERE owner = ''", (owner,))
+    cur.execute("UPDATE todos SET owner = %s WHERE owner = ''", (owner,))
+    if cur.rowcount:
+        logger.info("所有者の無いタスク%d件を%sに移しました", cur.rowcount, owner)
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANGE_CHANNEL, json.dumps({"op": "RESYNC"})))  # 開いているセッションに読み直してもらう
+
+# 所有者のタグ一覧を [(id, 名前), ...] の並び順で返す関数（1件も無ければ既定のタグを作る）
+def load_tags_from_db(owner):
+    return query_cache.fetch((owner, "tags"), lambda: _select_tags(owner))  # 同じ利用者のセッションで共有
+
+def _select_tags(owner):
+    with db_cursor() as cur:  # プールから接続を借りる
+        cur.execute("SELECT id, name FROM tags WHERE owner = %s ORDER BY position, id", (owner,))
+        tags = cur.fetchall()
+        if not tags:
+            tags = psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO tags (owner, name, position) VALUES %s ON CONFLICT (owner, name) DO NOTHING RETURNING id, name",
+                [(owner, name, i) for i, name in enumerate(DEFAULT_TAGS)],
+                fetch=True
+            )
+    return [(tag_id, name) for tag_id, name in tags]
+
+# タグ管理での変更をまとめて保存し、保存後のタグ一覧を返す関数（変わった行だけを書き換える）
+def save_tags_to_db(owner, old_tags, new_tags, origin=None):  # old_tags: 変更前の[(id, 名前)], new_tags: 変更後の[[id または None, 名前]]
+    old = {tag_id: (name, i) for i, (tag_id, name) in enumerate(old_tags)}
+    kept = {tag_id for tag_id, _ in new_tags if tag_id is not None}
+    deleted = [tag_id for tag_id in old if tag_id not in kept]
+    changed = [  # 名前か並び順が変わったタグ
+        (tag_id, owner, name, i) for i, (tag_id, name) in enumerate(new_tags)
+        if tag_id is not None and old.get(tag_id) != (name, i)
+    ]
+    renamed = [(tag_id, owner) for tag_id, _, name, _ in changed if old[tag_id][0] != name]
+    added = [(owner, name, i) for i, (tag_id, name) in enumerate(new_tags) if tag_id is None]
+    with db_cursor() as cur:  # 1トランザクションで反映
+        if origin:
+            cur.execute("SELECT set_config('todo.origin', %s, true)", (origin,))
+        if deleted:  # タグの削除は1文（タスクはON DELETE SET NULLで「その他」になる）
+            cur.execute("DELETE FROM tags WHERE owner = %s AND id = ANY(%s)", (owner, deleted))
+        if renamed:  # 一意制約は1行ごとに確かめられるので、入れ替え（A→B・B→C）でもぶつからないよう先に仮の名前にする
+            psycopg2.extras.execute_values(
+                cur,
+                "UPDATE tags SET name = chr(1) || tags.id FROM (VALUES %s) AS v (id, owner) "  # 入力できない制御文字で始まる名前
+                "WHERE tags.id = v.id AND tags.owner = v.owner",
+                renamed
+            )
+        if changed:  # 名前の変更はタグの行だけを書き換える（タスクはidで参照しているので書き換え不要）
+            psycopg2.extras.execute_values(
+                cur,
+                "UPDATE tags SET name = v.name, position = v.position "
+                "FROM (VALUES %s) AS v (id, owner, name, position) WHERE tags.id = v.id AND tags.owner = v.owner",
+                changed
+            )
+        ids = []
+        if added:
+            ids = psycopg2.extras.execute_values(
+                cur, "INSERT INTO tags (owner, name, position) VALUES %s RETURNING id", added, fetch=True
+            )
+    query_cache.invalidate(owner)  # タグの削除でタスクのタグも変わる
+    new_ids = iter(tag_id for (tag_id,) in ids)
+    return [(tag_id if tag_id is not None else next(new_ids), name) for tag_id, name in new_tags]
+
+# DBの1行を辞書形式に変換する関数
+def _row_to_dict(r):
+    return {
+        "id": r[0],
+        "name": r[1],
+        "completed": r[2],
+        "created_at": r[3],
+        "updated_at": r[4],
+        "tag_id": r[5]  # NULLなら「その他」
+    }
+
+# 所有者のタスクのうち条件に一致するものをid順に名前付きカーソル（サーバー側カーソル）で少しずつ読み出すジェネレータ
+def iter_tasks_from_db(owner, tag_id=ANY_TAG, completed=None, after_id=None, limit=None):
+    where = ["owner = %s"]  # WHERE句の条件（必ず所有者で絞る）
+    params = [owner]  # 条件の値
+    if tag_id is None:  # 「その他」（タグ無し）
+        where.append("tag_id IS NULL")
+    elif tag_id != ANY_TAG:  # タグで絞り込む
+        where.append("tag_id = %s")
+        params.append(tag_id)
+    if completed is not None:  # 完了状態で絞り込む
+        where.append("completed = %s")
+        params.append(completed)
+    if after_id is not None:  # キーセットページング（前のページの最後のidより後ろ）
+        where.append("id > %s")
+        params.append(after_id)
+    sql = "SELECT id, name, completed, created_at, updated_at, tag_id FROM todos WHERE " + " AND ".join(where)
+    sql += " ORDER BY id"  # (owner, tag_id, completed, id) の索引順に読む
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    with db_connection() as conn:  # プールから接続を借りる
+        with conn.cursor(name="todos_stream") as cur:  # 結果をサーバー側に置いたまま読む
+            cur.itersize = BULK_PAGE_SIZE if limit is None else limit  # 1往復で受け取る行数
+            cur.execute(sql, params)
+            for r in cur:
+                yield _row_to_dict(r)
+
+# タスク名の部分一致検索用のGIN索引を作る関数
+# 日本語は単語区切りが無いので、2文字単位のpg_bigmを優先し、無ければ3文字単位のpg_trgmを使う
+# （pg_trgmで日本語を扱うにはDBのロケールがマルチバイト文字を文字として扱える必要がある）
+def ensure_search_index(cur):
+    global _search_method
+    for method, extension, ops in (("bigm", "pg_bigm", "gin_bigm_ops"), ("trgm", "pg_trgm", "gin_trgm_ops")):
+        cur.execute("SAVEPOINT search_index")  # 拡張機能が入っていない・権限が無い場合は取り消して次を試す
+        try:
+            cur.execute(f"CREATE EXTENSION IF NOT EXISTS {extension}")
+            _create_index(cur, f"todos_name_{method}_idx", f"todos USING gin (name {ops})")
+        except psycopg2.Error as ex:
+            cur.execute("ROLLBACK TO SAVEPOINT search_index")
+            logger.info("%sを使えません: %s", extension, ex)
+            continue
+        cur.execute("RELEASE SAVEPOINT search_index")
+        _search_method = method
+        return
+    logger.warning("pg_bigm・pg_trgmが使えないため、検索は索引なしの部分一致になります")
+
+# LIKEの特殊文字をエスケープする関数
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# タスク名を部分一致で検索し、似ている順に1ページ分返す関数（[(タスクの辞書, 次のページの開始位置), ...]）
+def search_tasks(owner, text, after=None, limit=TASK_PAGE_SIZE):  # after: 前のページの最後の (スコア, id)
+    if _search_method == "bigm":  # LIKEはpg_bigmの索引を使う
+        score, match = "bigm_similarity(name, %s)", "name LIKE %s"
+    elif _search_method == "trgm":  # ILIKEもpg_trgmの索引を使う
+        score, match = "similarity(name, %s)", "name ILIKE %s"
+    else:  # 索引なし（前の方に出てくるものほど上位）
+        score, match = "-strpos(lower(name), lower(%s))", "name ILIKE %s"
+    params = [text, owner, "%" + _like_escape(text) + "%"]
+    sql = (
+        "SELECT id, name, completed, created_at, updated_at, tag_id, score FROM ("
+        f"SELECT *, ({score})::float8 AS score FROM todos WHERE owner = %s AND {match}"  # float8にして次ページの比較で誤差が出ないように
+        ") s"
+    )
+    if after is not None:  # (スコア, id) のキーセットで続きから
+        sql += " WHERE (score, id) < (%s, %s)"
+        params.extend(after)
+    sql += " ORDER BY score DESC, id DESC LIMIT %s"
+    params.append(limit)
+    with db_cursor() as cur:  # プールから接続を借りる
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return [(_row_to_dict(r), (r[6], r[0])) for r in rows]
+
+# 所有者とidを指定してタスクを1件取得する関数（見つからなければNone）
+def get_task_from_db(owner, task_id):
+    with db_cursor() as cur:  # プールから接続を借りる
         cur.execute(
-            "INSERT INTO todos (name, completed, created_at, updated_at, tag) VALUES (%s, %s, %s, %s, %s)",
-            (t.task_name, t.completed, t.created_at, t.updated_at, t.tag)
+            "SELECT id, name, completed, created_at, updated_at, tag_id FROM todos WHERE owner = %s AND id = %s",
+            (owner, task_id)
         )
-    conn.commit()  # コミットして反映
-    cur.close()  # カーソルを閉じる
-    conn.close()  # 接続を閉じる
-
-# DBからタスクを読み込んで辞書形式で返す関数
-def load_tasks_from_db():
-    conn = get_conn()  # DB接続
-    cur = conn.cursor()  # カーソル作成
-    cur.execute("SELECT name, completed, created_at, updated_at, tag FROM todos")  # データ取得
-    rows = cur.fetchall()  # 結果をすべて取得
-    cur.close()  # カーソルを閉じる
-    conn.close()  # 接続を閉じる
-    # 各行を辞書形式に変換してリストで返す
-    return [{
-        "name": r[0],
-        "completed": r[1],
-        "created_at": r[2],
-        "updated_at": r[3],
-        "tag": r[4] or "その他"  # タグがNULLなら「その他」にする
-    } for r in rows]
+        r = cur.fetchone()
+    return _row_to_dict(r) if r else None
+
+# 条件に一致するタスクを1ページ分だけ取得する関数（同じページは全セッションで読み取りキャッシュを共有）
+def query_tasks(owner, tag_id=ANY_TAG, completed=None, after_id=None, limit=TASK_PAGE_SIZE):
+    return query_cache.fetch(
+        (owner, "tasks", tag_id, completed, after_id, limit),
+        lambda: list(iter_tasks_from_db(owner, tag_id, completed, after_id, limit))
+    )
+
+#──────────────────────────────
+# 一括入出力（インポート・エクスポート）
+#──────────────────────────────
+EXPORT_COLUMNS = ["id", "owner", "name", "completed", "created_at", "updated_at", "tag"]  # エクスポートする列
+IMPORT_COLUMNS = ["owner", "name", "completed", "created_at", "updated_at", "tag"]  # インポートする列（idは採番し直し、タグは名前で対応付ける）
+
+def _parse_bool(value):  # CSV/JSONの値を真偽値に変換
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "t", "true", "y", "yes")
+
+def _csv_value(value):  # DBの値をCSVの1セルに変換
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else value
+
+def _read_import_rows(fp, fmt, owner=None):  # ファイルから1行ずつタプルを取り出すジェネレータ（全件をメモリに載せない）
+    if fmt == "csv":
+        records = csv.DictReader(fp)
+    else:
+        records = (json.loads(line) for line in fp if line.strip())
+    for r in records:
+        yield (
+            (r.get("owner") or "") if owner is None else owner,  # 所有者の指定があればそれに揃える
+            r["name"],
+            _parse_bool(r.get("completed", False)),
+            r.get("created_at") or None,
+            r.get("updated_at") or None,
+            r.get("tag") or None  # 空欄・「その他」はタグ無し
+        )
+
+class _CopyStream:  # 行のイテレータをCOPY FROM STDIN用のファイルとして読ませるクラス
+    def __init__(self, rows):
+        self.rows = rows  # IMPORT_COLUMNS順のタプルのイテレータ
+        self.buffer = ""  # 未送信の文字列
+
+    def _line(self, row):  # 1行をCOPYのCSV形式に変換（NULLは空欄、空文字は""）
+        out = []
+        for v in row:
+            if v is None:
+                out.append("")
+            elif isinstance(v, bool):
+                out.append("t" if v else "f")
+            else:
+                out.append('"' + str(v).replace('"', '""') + '"')
+        return ",".join(out) + "\n"
+
+    def read(self, size=-1):  # copy_expertから呼ばれ、必要な分だけ行を変換して返す
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += self._line(row)
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+def bulk_insert_rows(cur, rows):  # 行をBULK_PAGE_SIZE件ずつexecute_valuesで取り込み用の一時テーブルへINSERTする
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BULK_PAGE_SIZE:
+            psycopg2.extras.execute_values(
+                cur, "INSERT INTO todos_import (owner, name, completed, created_at, updated_at, tag) VALUES %s", batch,
+                page_size=BULK_PAGE_SIZE
+            )
+            count += len(batch)
+            batch = []
+    if batch:
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO todos_import (owner, name, completed, created_at, updated_at, tag) VALUES %s", batch,
+            page_size=BULK_PAGE_SIZE
+        )
+        count += len(batch)
+    return count
+
+def copy_rows_to_db(cur, rows):  # 行をCOPY FROM STDINで取り込み用の一時テーブルへ流し込む（大量データ向け）
+    cur.copy_expert(
+        "COPY todos_import (owner, name, completed, created_at, updated_at, tag) FROM STDIN WITH (FORMAT csv)",
+        _CopyStream(iter(rows)),
+        size=65536
+    )
+    return cur.rowcount
+
+def import_tasks(fp, fmt="csv", replace=False, use_copy=True, owner=None):  # ファイルからtodosテーブルへ一括インポート
+    rows = _read_import_rows(fp, fmt, owner)
+    with db_cursor() as cur:  # 全件を1トランザクションで取り込む
+        cur.execute("SELECT set_config('todo.bulk', 'on', true)")  # 1行ごとの変更通知を止める
+        cur.execute(  # タグ名のまま受け取る一時テーブル（コミット時に消える）
+            "CREATE TEMP TABLE todos_import (seq BIGSERIAL, owner TEXT, name TEXT, completed BOOLEAN, "
+            "created_at TEXT, updated_at TEXT, tag TEXT) ON COMMIT DROP"
+        )
+        if replace:  # バックアップ復元時は既存タスクを置き換える（所有者の指定があればその所有者の分だけ）
+            if owner is None:
+                cur.execute("DELETE FROM todos")
+            else:
+                cur.execute("DELETE FROM todos WHERE owner = %s", (owner,))
+        if use_copy:
+            count = copy_rows_to_db(cur, rows)
+        else:
+            count = bulk_insert_rows(cur, rows)
+        cur.execute(  # 新しいタグ名をまとめて登録
+            "INSERT INTO tags (owner, name) SELECT DISTINCT owner, tag FROM todos_import "
+            "WHERE tag IS NOT NULL AND tag <> 'その他' ON CONFLICT (owner, name) DO NOTHING"
+        )
+        cur.execute(  # タグ名をidに置き換えてtodosへ移す
+            "INSERT INTO todos (owner, name, completed, created_at, updated_at, tag_id) "
+            "SELECT i.owner, i.name, i.completed, i.created_at, i.updated_at, g.id FROM todos_import i "
+            "LEFT JOIN tags g ON g.owner = i.owner AND g.name = i.tag ORDER BY i.seq"
+        )
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANGE_CHANNEL, json.dumps({"op": "RESYNC"})))  # 各セッションに読み直してもらう
+    if owner is None:  # ファイルのowner列次第でどの利用者の行も変わりうる
+        query_cache.clear()
+    else:
+        query_cache.invalidate(owner)
+    return count
+
+def export_tasks(fp, fmt="csv", owner=None):  # todosテーブルをファイルへ一括エクスポート（サーバー側カーソルで少しずつ取得）
+    count = 0
+    sql = (
+        "SELECT t.id, t.owner, t.name, t.completed, t.created_at, t.updated_at, g.name "
+        "FROM todos t LEFT JOIN tags g ON g.id = t.tag_id"  # タグはidではなく名前で書き出す
+    )
+    params = []
+    if owner is not None:  # 所有者の指定があればその所有者の分だけ
+        sql += " WHERE t.owner = %s"
+        params.append(owner)
+    with db_connection() as conn:
+        with conn.cursor(name="todos_export") as cur:  # 名前付きカーソル＝結果をサーバー側に置いたまま読む
+            cur.itersize = BULK_PAGE_SIZE  # 1往復で受け取る行数
+            cur.execute(sql + " ORDER BY t.id", params)
+            writer = csv.writer(fp) if fmt == "csv" else None
+            if writer:
+                writer.writerow(EXPORT_COLUMNS)  # ヘッダー行
+            for r in cur:
+                if writer:
+                    writer.writerow([_csv_value(v) for v in r])
+                else:
+                    fp.write(json.dumps(dict(zip(EXPORT_COLUMNS, r)), ensure_ascii=False, default=str) + "\n")
+                count += 1
+    return count
+
+#──────────────────────────────
+# 変更追跡（行単位の保存）
+#──────────────────────────────
+class TaskChanges:  # 未保存のタスク変更をタスク単位で追跡し、必要な文だけを発行するクラス（スレッドセーフ）
+    def __init__(self, owner, on_saved=None, on_error=None, origin=None):
+        self.owner = owner  # 所有者（全ての文をこの所有者の行に限定する）
+        self.origin = origin  # 変更元のセッション識別子（自分の変更通知を無視するために通知に載せる）
+        self.pending = {}  # Task -> "save"（INSERTまたはUPDATE）/ "delete"。最後の一括操作より後の変更（同じタスクへの変更は1件にまとまる）
+        self.statements = []  # 行単位では表せない一括操作 [(その前に記録された行の変更, SQL, 引数)]。記録した順に実行する
+        self.flushing = []  # 保存中（コミット前）の行の変更。コミットまでは保存待ちとして扱う（読み直しで消えたり、削除した行を読み戻したりしないように）
+        self.lock = threading.Lock()  # UIスレッドと保存ワーカーの排他
+        self.on_saved = on_saved  # 保存成功時のコールバック（新たに主キーが付いたタスク, 失敗から回復したか）
+        self.on_error = on_error  # 保存失敗時のコールバック（例外, 再試行までの秒数）
+        self.failures = 0  # 連続して失敗した回数（再試行の間隔に使う）
+
+    def _mark(self, task, op):  # 行の変更を記録（一括操作より前に記録済みなら、そこから外して一括操作の後に回す）
+        with self.lock:
+            for rows, _, _ in self.statements:
+                rows.pop(task, None)
+            self.pending[task] = op
+
+    def mark_new(self, task):  # 新規タスクを記録
+        self._mark(task, "save")
+
+    def mark_dirty(self, task):  # 変更されたタスクを記録（INSERT前ならINSERT時に最新の値が入る）
+        self._mark(task, "save")
+
+    def mark_deleted(self, task):  # 削除されたタスクを記録
+        self._mark(task, "delete")
+
+    def add_statement(self, sql, params=None):  # 集合単位の更新（読み込んでいない行も対象）を記録（これより後の行の変更はこの後に実行）
+        with self.lock:
+            self.statements.append((self.pending, sql, params))
+            self.pending = {}
+
+    def _all_rows(self, flushing=True):  # 記録済みの全ての行の変更（flushing=Trueなら保存中の分も含める。lockを持って呼ぶ）
+        if flushing:
+            for rows in self.flushing:
+                yield from rows.items()
+        for rows, _, _ in self.statements:
+            yield from rows.items()
+        yield from self.pending.items()
+
+    def is_pending(self, task):  # 保存待ちの変更があるタスクかどうか
+        with self.lock:
+            return (task in self.pending or any(task in rows for rows in self.flushing)
+                    or any(task in rows for rows, _, _ in self.statements))
+
+    def saving_tasks(self):  # 保存待ち（INSERT・UPDATE）のタスク
+        with self.lock:
+            return [t for t, op in self._all_rows() if op == "save"]
+
+    def deleted_ids(self):  # 削除待ちのタスクのid（まだDBに残っている行を読み直さないように）
+        with self.lock:
+            return {t.id for t, op in self._all_rows() if op == "delete" and t.id is not None}
+
+    def flush(self):  # 記録された変更だけをDBに反映し、新たに主キーが付いたタスクを返す（同時に1つだけ呼ぶこと）
+        with self.lock:  # 送る分を取り出す（保存中の操作は次回に回る）
+            if not self.pending and not self.statements:
+                return []
+            pending, self.pending = self.pending, {}
+            statements, self.statements = self.statements, []
+            self.flushing = [rows for rows, _, _ in statements] + [pending]
+        saved = []  # (新規タスク, 採番された主キー)
+        try:
+            with db_cursor() as cur:  # プールから接続を借りる（全体を1トランザクションで反映）
+                if self.origin:
+                    cur.execute("SELECT set_config('todo.origin', %s, true)", (self.origin,))  # トリガーが通知に載せる
+                for rows, sql, params in statements:  # 一括操作はその前に記録された行の変更の後で実行
+                    saved += self._write_rows(cur, rows)
+                    cur.execute(sql, params)
+                saved += self._write_rows(cur, pending)
+        except Exception:
+            with self.lock:  # 失敗した分を保存中に記録された変更の前に戻す（同じタスクは新しい操作を優先）
+                self.flushing = []
+                newer = {t for t, _ in self._all_rows()}
+                for rows, _, _ in statements:
+                    for t in newer.intersection(rows):
+                        del rows[t]
+                rest = {t: op for t, op in pending.items() if t not in newer}
+                if self.statements:
+                    rows, sql, params = self.statements[0]
+                    self.statements[0] = ({**rest, **rows}, sql, params)
+                else:
+                    self.pending = {**rest, **self.pending}
+                self.statements = statements + self.statements
+            raise
+        query_cache.invalidate(self.owner)  # コミット後に消す（変更通知を待たずに同じプロセスの他のセッションへ反映）
+        with self.lock:  # 主キーを付けてから保存中の扱いをやめる（その間に読み直しても同じタスクを2つ作らないように）
+            for t, task_id in saved:
+                t.id = task_id  # 以降の変更はUPDATEで反映される
+            self.flushing = []
+        return [t for t, _ in saved]
+
+    def _write_rows(self, cur, rows):  # 行の変更をまとめてINSERT・UPDATE・DELETEし、[(新規タスク, 主キー)] を返す
+        # 取り出した時点のidで振り分ける（保存中に追加されたタスクは次回UPDATEになる）
+        new = [t for t, op in rows.items() if op == "save" and t.id is None]
+        dirty = [t for t, op in rows.items() if op == "save" and t.id is not None]
+        deleted = [t.id for t, op in rows.items() if op == "delete" and t.id is not None]
+        ids = []
+        if new:  # 新規タスクをまとめてINSERTして主キーを受け取る
+            ids = psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO todos (owner, name, completed, created_at, updated_at, tag_id) VALUES %s RETURNING id",
+                [(self.owner, t.task_name, t.completed, t.created_at, t.updated_at, t.tag_id) for t in new],
+                page_size=BULK_PAGE_SIZE,
+                fetch=True
+            )
+        if dirty:  # 変更されたタスクをまとめて主キー指定でUPDATE
+            psycopg2.extras.execute_values(
+                cur,
+                "UPDATE todos SET name = v.name, completed = v.completed, updated_at = v.updated_at, "
+                "tag_id = v.tag_id::integer "  # 全行NULLだとtext型になるため型を明示
+                "FROM (VALUES %s) AS v (id, owner, name, completed, updated_at, tag_id) "
+                "WHERE todos.id = v.id AND todos.owner = v.owner",
+                [(t.id, self.owner, t.task_name, t.completed, t.updated_at, t.tag_id) for t in dirty],
+                page_size=BULK_PAGE_SIZE
+            )
+        if deleted:  # 削除されたタスクを1文でまとめてDELETE
+            cur.execute("DELETE FROM todos WHERE owner = %s AND id = ANY(%s)", (self.owner, deleted))
+        return [(t, task_id) for t, (task_id,) in zip(new, ids)]
+
+#──────────────────────────────
+# 書き込みの遅延・一括保存（ライトビハインド）
+#──────────────────────────────
+class WriteBehind:  # 各セッションのTaskChangesを短い待ち時間の後にまとめて保存するバックグラウンドワーカー（プロセスで1つ）
+    def __init__(self, delay, max_retry_delay):
+        self.delay = delay  # 最初の変更から保存までの待ち時間（この間の変更は1回にまとまる）
+        self.max_retry_delay = max_retry_delay  # 失敗時の再試行間隔の上限
+        self.queue = {}  # TaskChanges -> 保存予定時刻
+        self.cond = threading.Condition()  # キューの排他と待ち合わせ
+        self.thread = None  # ワーカースレッド（最初の登録時に起動）
+        self.busy = 0  # 保存中の件数
+
+    def schedule(self, changes, delay=None):  # 保存を予約（予約済みなら早い方の時刻を使う）
+        due = time.monotonic() + (self.delay if delay is None else delay)
+        with self.cond:
+            if changes not in self.queue or due < self.queue[changes]:
+                self.queue[changes] = due
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def run(self):  # 予定時刻になったものから順に保存する
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    due = [c for c, t in self.queue.items() if t <= now]
+                    if due:
+                        break
+                    timeout = min(self.queue.values()) - now if self.queue else None
+                    self.cond.wait(timeout)
+                for c in due:
+                    del self.queue[c]
+                self.busy = len(due)
+            for changes in due:
+                self.save(changes)
+            with self.cond:
+                self.busy = 0
+                self.cond.notify_all()  # drain()で待っているスレッドに知らせる
+
+    def save(self, changes):  # 1セッション分を保存し、結果をコールバックで通知
+        started = time.perf_counter()
+        try:
+            saved = changes.flush()
+        except Exception as ex:
+            metrics.inc("todo_write_behind_failures_total")
+            changes.failures += 1
+            retry_in = min(self.delay * 2 ** changes.failures, self.max_retry_delay)  # 失敗が続くほど間隔を空ける
+            logger.warning("保存に失敗しました（%d回目、%.1f秒後に再試行）: %s", changes.failures, retry_in, ex)
+            self.schedule(changes, retry_in)
+            callback, args = changes.on_error, (ex, retry_in)
+        else:
+            metrics.observe("todo_write_behind_seconds", time.perf_counter() - started)
+            recovered = changes.failures > 0
+            changes.failures = 0
+            callback, args = changes.on_saved, (saved, recovered)
+        if callback:
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("保存結果の通知に失敗しました")  # 切断済みのセッションなど
+
+    def drain(self, timeout=10):  # 予約済みの保存をすぐに実行し、終わるまで待つ（終了時用）
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            for c in self.queue:
+                self.queue[c] = 0
+            self.cond.notify_all()
+            while (self.queue or self.busy) and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+
+write_behind = WriteBehind(WRITE_BEHIND_DELAY, WRITE_BEHIND_MAX_RETRY)  # プロセス共通の保存ワーカー
+metrics.gauge("todo_write_behind_pending", "保存待ちのセッション数", lambda: len(write_behind.queue) + write_behind.busy)
+
+#──────────────────────────────
+# 読み取りキャッシュ（プロセス内の全セッションで共有）
+#──────────────────────────────
+def _rows_size(rows):  # 問い合わせ結果の大きさの目安（バイト数）
+    size = sys.getsizeof(rows)
+    for r in rows:
+        size += sys.getsizeof(r) + sum(sys.getsizeof(v) for v in (r.values() if isinstance(r, dict) else r))
+    return size
+
+class QueryCache:  # 問い合わせ結果を所有者ごとに保持するLRUキャッシュ（書き込みと変更通知で所有者単位に消す）
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes  # 保持する結果の大きさの上限（0なら使わない）
+        self.entries = OrderedDict()  # キー -> (結果の行, 大きさ)。先頭ほど長く使われていない
+        self.owner_keys = {}  # 所有者 -> {キー: None}（所有者単位で消すため）
+        self.loading = {}  # キー -> Future（同じ問い合わせが同時に来たらDBへは1回だけ。消されたら読み込み結果を保存しない）
+        self.size = 0  # 保持している結果の大きさの合計
+        self.enabled = False  # 変更通知を受信している間だけ使う（通知を取りこぼすと古い結果を返してしまうため）
+        self.lock = threading.Lock()  # 全セッションのスレッドからの排他
+
+    def fetch(self, key, load):  # キーの結果を返す（無ければload()で読み込んで保存する）。key[0]は所有者
+        if not self.enabled:  # 変更通知を受信していない間は毎回DBから読む
+            return load()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                metrics.inc("todo_query_cache_requests_total", result="hit")
+                return list(self.entries[key][0])
+            future = self.loading.get(key)
+            waiting = future is not None  # 他のセッションが同じ問い合わせを実行中なら結果を待つ
+            if not waiting:
+                future = self.loading[key] = Future()
+        metrics.inc("todo_query_cache_requests_total", result="wait" if waiting else "miss")
+        if waiting:
+            return list(future.result())
+        try:
+            rows = tuple(load())
+        except BaseException as ex:
+            with self.lock:
+                if self.loading.get(key) is future:
+                    del self.loading[key]
+            future.set_exception(ex)  # 待っているセッションにも同じ例外を伝える
+            raise
+        with self.lock:
+            if self.loading.get(key) is future:  # 読み込み中に消されていなければ保存
+                del self.loading[key]
+                self._put(key, rows)
+        future.set_result(rows)
+        return list(rows)
+
+    def _put(self, key, rows):  # 結果を保存し、上限を超えた分を使われていない順に捨てる（lockを持って呼ぶ）
+        size = _rows_size(rows)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (rows, size)
+        self.owner_keys.setdefault(key[0], {})[key] = None
+        self.size += size
+        while self.size > self.max_bytes:
+            old_key, (_, old_size) = self.entries.popitem(last=False)
+            self.size -= old_size
+            keys = self.owner_keys[old_key[0]]
+            del keys[old_key]
+            if not keys:
+                del self.owner_keys[old_key[0]]
+            metrics.inc("todo_query_cache_evictions_total")
+
+    def invalidate(self, owner):  # 所有者の結果を全て消す（読み込み中のものも保存させない）
+        with self.lock:
+            for key in self.owner_keys.pop(owner, {}):
+                self.size -= self.entries.pop(key)[1]
+            for key in [k for k in self.loading if k[0] == owner]:
+                del self.loading[key]
+
+    def clear(self):  # 全ての結果を消す
+        with self.lock:
+            self.entries.clear()
+            self.owner_keys.clear()
+            self.loading.clear()
+            self.size = 0
+
+    def set_enabled(self, enabled):  # 変更通知の受信を始めたら使い始め、切れたら消して使わない
+        with self.lock:
+            self.enabled = enabled and self.max_bytes > 0
+        if not enabled:
+            self.clear()
+
+query_cache = QueryCache(int(QUERY_CACHE_MB * 1024 * 1024))  # プロセス共通の読み取りキャッシュ
+metrics.gauge("todo_query_cache_bytes", "読み取りキャッシュが保持している結果の大きさ（目安のバイト数）", lambda: query_cache.size)
+metrics.gauge("todo_query_cache_entries", "読み取りキャッシュが保持している結果の数", lambda: len(query_cache.entries))
+
+#──────────────────────────────
+# 変更通知（LISTEN/NOTIFY）による全セッションの同期
+#──────────────────────────────
+class ChangeFeed:  # 1本のLISTEN接続で受けたtodosの変更通知を、購読中の全セッションへ配るクラス（プロセスで1つ）
+    def __init__(self, channel):
+        self.channel = channel  # LISTENするチャンネル名
+        self.subscribers = {}  # 購読番号 -> (所有者, コールバック（変更通知のリストを受け取る）)
+        self.lock = threading.Lock()  # 購読者一覧の排他
+        self.thread = None  # 受信スレッド（最初の購読時に起動）
+        self.next_token = 0  # 次に払い出す購読番号
+
+    def subscribe(self, owner, callback):  # 所有者の行の変更通知の購読を開始し、購読番号を返す
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            self.subscribers[token] = (owner, callback)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="change-feed", daemon=True)
+                self.thread.start()
+        return token
+
+    def unsubscribe(self, token):  # 購読をやめる（セッション終了時）
+        with self.lock:
+            self.subscribers.pop(token, None)
+
+    def publish(self, events):  # 受け取った通知を所有者ごとに分けて購読者へ配る（所有者の無いRESYNCは全員へ）
+        metrics.inc("todo_change_events_total", len(events))
+        by_owner = {}
+        broadcast = []
+        for ev in events:
+            if ev["op"] == "RESYNC":
+                broadcast.append(ev)
+            else:
+                owner = ev["row"]["owner"] if ev.get("row") else ev.get("owner")
+                by_owner.setdefault(owner, []).append(ev)
+        if broadcast:  # 配る前に古い結果を消す（受け取ったセッションが読み直したときに最新の行を読むように）
+            query_cache.clear()
+        for owner in by_owner:
+            query_cache.invalidate(owner)
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for owner, callback in subscribers:
+            mine = by_owner.get(owner, []) + broadcast
+            if not mine:
+                continue  # 他の所有者の変更は配らない
+            try:
+                callback(mine)
+            except Exception:
+                logger.exception("変更通知の配信に失敗しました")
+
+    def run(self):  # 通知を受信し続ける（切断されたら再接続し、取りこぼし分はRESYNCで読み直させる）
+        delay = 1  # 再接続までの待ち時間
+        connected_before = False
+        while True:
+            conn = None
+            try:
+                conn = get_conn()  # プールとは別の専用接続（LISTEN中は他の用途に使えないため）
+                conn.set_session(autocommit=True)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                query_cache.set_enabled(True)  # 以降の変更は通知で消せる
+                if connected_before:
+                    self.publish([{"op": "RESYNC"}])  # 切断中の変更は届かないので読み直してもらう
+                connected_before = True
+                delay = 1
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):  # 30秒通知が無ければ接続を確認
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT 1")
+                        continue
+                    conn.poll()
+                    events = []  # 1回で届いた分をまとめて配る（一括削除などで画面更新を1回にするため）
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            events.append(json.loads(notify.payload))
+                        except ValueError:
+                            logger.warning("不正な変更通知を無視しました: %s", notify.payload)
+                    if events:
+                        self.publish(events)
+            except (psycopg2.Error, OSError) as ex:
+                logger.warning("変更通知の接続が切れました（%d秒後に再接続）: %s", delay, ex)
+            finally:
+                query_cache.set_enabled(False)  # 受信できない間の変更では消せないので使わない
+                if conn is not None:
+                    conn.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+change_feed = ChangeFeed(CHANGE_CHANNEL)  # プロセス共通の変更通知の受信
+metrics.gauge("todo_active_sessions", "開いているセッション数", lambda: len(change_feed.subscribers))
+
+#──────────────────────────────
+# タスクの索引付きストア（メモリ上）
+#──────────────────────────────
+class TaskStore:  # タスクをid・タグ・完了状態で索引付けし、フィルターを結果件数に比例する時間で返すクラス
+    def __init__(self):
+        self.by_id = {}  # id -> Task（保存済みのタスクのみ）
+        self.by_key = {}  # (タグ, 完了状態) -> {Task: None}（順序付き集合としてdictを使う）
+        self.by_status = {False: {}, True: {}}  # 完了状態 -> {Task: None}（タグ指定なしのフィルター用）
+        self.keys = {}  # Task -> 索引に登録した (タグ, 完了状態)
+        self.seq = {}  # Task -> 追加順の番号（表示順）
+        self.unsorted = set()  # 追加順が崩れている集合（次のフィルター時に並べ直す）
+        self.next_seq = 0  # 次に割り当てる追加順の番号
+        self.next_last_seq = 1 << 62  # 後から読み込む行よりも後ろに並べるタスクの番号（読み直し時の未保存のタスク用）
+
+    def _insert(self, bucket_name, bucket, task):  # 集合に追加（末尾より前の順番なら並べ直しが必要と記録）
+        if bucket and self.seq[next(reversed(bucket))] > self.seq[task]:
+            self.unsorted.add(bucket_name)
+        bucket[task] = None
+
+    def _index(self, task):  # タスクを現在のタグ・完了状態の索引に登録
+        key = (task.tag_id, bool(task.completed))
+        self.keys[task] = key
+        self._insert(key, self.by_key.setdefault(key, {}), task)
+        self._insert(key[1], self.by_status[key[1]], task)
+
+    def _unindex(self, task):  # タスクを索引から外す
+        key = self.keys.pop(task)
+        bucket = self.by_key[key]
+        del bucket[task]
+        if not bucket:  # 空になった集合は消す（tags()に残さない）
+            del self.by_key[key]
+            self.unsorted.discard(key)
+        del self.by_status[key[1]][task]
+
+    def add(self, task, last=False):  # タスクを末尾に追加（last=Trueなら後から追加するタスクよりも後ろに並べる）
+        if last:
+            self.seq[task] = self.next_last_seq
+            self.next_last_seq += 1
+        else:
+            self.seq[task] = self.next_seq
+            self.next_seq += 1
+        self._index(task)
+        self.index_id(task)
+
+    def remove(self, task):  # タスクを削除
+        if task not in self.keys:
+            return
+        self._unindex(task)
+        del self.seq[task]
+        if task.id is not None:
+            self.by_id.pop(task.id, None)
+
+    def reindex(self, task):  # タグ・完了状態が変わったタスクを付け替える（変わっていなければ何もしない）
+        if task not in self.keys:
+            return
+        if self.keys[task] != (task.tag_id, bool(task.completed)):
+            self._unindex(task)
+            self._index(task)
+
+    def index_id(self, task):  # 主キーが付いたタスクをidの索引に登録
+        if task.id is not None:
+            self.by_id[task.id] = task
+
+    def get(self, task_id):  # idからタスクを取得
+        return self.by_id.get(task_id)
+
+    def _ordered(self, bucket_name, bucket):  # 集合を追加順に並べて返す（崩れているときだけ並べ直す）
+        if bucket_name in self.unsorted:
+            items = sorted(bucket, key=self.seq.__getitem__)
+            bucket.clear()
+            bucket.update(dict.fromkeys(items))
+            self.unsorted.discard(bucket_name)
+        return list(bucket)
+
+    def filter(self, tag_id, completed):  # タグid（ANY_TAGなら全タグ、Noneなら「その他」）と完了状態で絞り込んだタスクを追加順で返す
+        completed = bool(completed)
+        if tag_id == ANY_TAG:
+            return self._ordered(completed, self.by_status[completed])
+        key = (tag_id, completed)
+        if key not in self.by_key:
+            return []
+        return self._ordered(key, self.by_key[key])
+
+    def count(self, tag_id=ANY_TAG, completed=None):  # 件数を返す（索引の大きさを見るだけで走査しない）
+        if tag_id == ANY_TAG:
+            if completed is None:
+                return len(self.keys)
+            return len(self.by_status[bool(completed)])
+        if completed is None:
+            return self.count(tag_id, False) + self.count(tag_id, True)
+        return len(self.by_key.get((tag_id, bool(completed)), ()))
+
+    def tags(self):  # タスクが1件以上あるタグidの一覧
+        return {tag_id for tag_id, _ in self.by_key}
+
+#──────────────────────────────
+# UI差分更新と送信量の計測
+#──────────────────────────────
+class UiMeter:  # セッションごとにFletクライアントへ送ったメッセージ数・バイト数・コントロール数を操作単位で数えるクラス
+    def __init__(self, page):
+        self.stats = {}  # 操作名 -> {"interactions", "messages", "bytes", "controls"} の累計
+        self.last = None  # 直前の操作の計測結果
+        self.current = "other"  # 計測中の操作名（操作の外で送られたものは"other"）
+        self.lock = threading.RLock()  # セッションの状態（ストア・表示・計測中の操作）の排他。UIの操作・変更通知・保存結果・検索・読み込みは全てこれを持って動く
+        self.session_id = session_id = page.session_id
+        conn = getattr(page, "_Page__conn", None)  # 送信を見られる公開APIが無いため、Fletの接続をラップする
+        if conn is not None:
+            send_commands = conn.send_commands
+
+            def metered_send_commands(sid, commands):  # このセッション宛ての送信だけを数える
+                if sid == session_id:
+                    self.record(commands)
+                return send_commands(sid, commands)
+
+            conn.send_commands = metered_send_commands
+
+    def _entry(self, name):  # 操作名ごとの集計欄
+        return self.stats.setdefault(name, {"interactions": 0, "messages": 0, "bytes": 0, "controls": 0})
+
+    def record(self, commands):  # 1回の送信（1メッセージ）を集計
+        entry = self._entry(self.current)
+        size = len(json.dumps(commands, cls=CommandEncoder, separators=(",", ":")))
+        controls = 0
+        for cmd in commands:  # 追加されたコントロールと属性が変わったコントロールを数える
+            controls += len(cmd.commands) if cmd.name == "add" else len(cmd.values) if cmd.name == "remove" else 1
+        entry["messages"] += 1
+        entry["bytes"] += size
+        entry["controls"] += controls
+        metrics.observe("todo_ui_update_controls", controls, handler=self.current)
+        metrics.inc("todo_ui_sent_bytes_total", size, handler=self.current)
+
+    @contextmanager
+    def interaction(self, name):  # with文の間に送られた分を1回の操作として集計（処理時間もメトリクスに記録。同じセッションの操作は1つずつ実行）
+        with self.lock:  # 送信はFletのページのロックを取るので、必ずこちらを先に取る
+            previous = self.current
+            before = dict(self._entry(name))
+            queries_before, db_before = metrics.thread_stats()
+            profiler = start_profile(name) if previous == "other" else None  # 入れ子の操作は外側でまとめて計測
+            self.current = name
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - started
+                if profiler is not None:
+                    stop_profile(profiler, name)
+                metrics.observe("todo_handler_seconds", elapsed, handler=name)
+                self.current = previous
+                entry = self._entry(name)
+                entry["interactions"] += 1
+                self.last = {k: entry[k] - before[k] for k in ("messages", "bytes", "controls")}
+                self.last["name"] = name
+                if UI_METER_LOG:
+                    logger.info("ui %(name)s: %(messages)d messages, %(bytes)d bytes, %(controls)d controls", self.last)
+                if SLOW_OP_MS and elapsed * 1000 >= SLOW_OP_MS:  # 遅い操作は内訳（DB・送信量）をJSONで出す
+                    queries, db_seconds = metrics.thread_stats()
+                    logger.warning(json.dumps({
+                        "event": "slow_operation",
+                        "handler": name,
+                        "session": self.session_id,
+                        "ms": round(elapsed * 1000, 1),
+                        "db_queries": queries - queries_before,
+                        "db_ms": round((db_seconds - db_before) * 1000, 1),
+                        "ui_messages": self.last["messages"],
+                        "ui_bytes": self.last["bytes"],
+                        "ui_controls": self.last["controls"],
+                    }, ensure_ascii=False))
+
+class UiPatch:  # 1回の操作で変わったコントロールだけを集め、まとめて1メッセージで送るクラス
+    def __init__(self, page):
+        self.page = page  # 送信先のページ
+        self.dirty = {}  # 変更されたコントロール（順序付き集合としてdictを使う）
+
+    def mark(self, *controls):  # 変更されたコントロールを記録
+        for c in controls:
+            self.dirty[c] = None
+
+    def set(self, control, **attrs):  # 値が実際に変わった属性だけを書き換えて記録
+        changed = False
+        for name, value in attrs.items():
+            if getattr(control, name) != value:
+                setattr(control, name, value)
+                changed = True
+        if changed:
+            self.mark(control)
+        return changed
+
+    def sync_list(self, parent, new_items, attr="controls"):  # 子要素の一覧を差し替え、追加・削除されたものを返す
+        old_items = getattr(parent, attr)
+        if len(old_items) == len(new_items) and all(a is b for a, b in zip(old_items, new_items)):
+            return [], []  # 変化なし（送信しない）
+        old_set = set(old_items)
+        new_set = set(new_items)
+        added = [c for c in new_items if c not in old_set]
+        removed = [c for c in old_items if c not in new_set]
+        old_items[:] = new_items  # Fletが前回との差分（追加・削除・移動）だけを送る
+        self.mark(parent)
+        return added, removed
+
+    def commit(self):  # 記録したコントロールをまとめて送信
+        controls = [c for c in self.dirty if c.uid is not None]  # まだ画面に無いものは親の追加で送られる
+        self.dirty.clear()
+        if controls:
+            started = time.perf_counter()
+            self.page.update(*controls)
+            metrics.observe("todo_ui_update_seconds", time.perf_counter() - started)
 
 #──────────────────────────────
 # タスク（1行分）
 #──────────────────────────────
-class Task(Container):  # タスクを表すコンポーネント（Containerを継承）
-    def __init__(self, task_name, task_status_change, task_delete,
-                 tag="その他", created_at=None, updated_at=None, page=None):
-        super().__init__()  # 親クラスの初期化
-        self.page = page  # ページ参照（編集時に必要）
+class Task:  # タスク1件分のデータ（コントロールは持たず、画面に出ている間だけTaskViewを割り当てる）
+    __slots__ = ("id", "task_name", "completed", "tag_id", "created_at", "updated_at", "view")
 
+    def __init__(self, task_name, tag_id=None, completed=False, created_at=None, updated_at=None, task_id=None):
+        self.id = task_id  # DB上の主キー（未保存ならNone）
         self.task_name = task_name  # タスク名
-        self.task_status_change = task_status_change  # 状態変更時のコールバック
-        self.task_delete = task_delete  # 削除時のコールバック
-        self.completed = False  # 完了状態フラグ
-        self.tag = tag  # タグ
+        self.completed = completed  # 完了状態フラグ
+        self.tag_id = tag_id  # タグのid（Noneなら「その他」）
         now = datetime.now().strftime("%m月%d日")  # 現在日時（MM月DD日形式）
         self.created_at = created_at or now  # 作成日時
         self.updated_at = updated_at or now  # 更新日時
+        self.view = None  # 表示中ならそのTaskView
+
+    def refresh(self, data):  # 他のセッションで変更された内容を反映
+        self.task_name = data["name"]
+        self.completed = data["completed"]
+        self.tag_id = data["tag_id"]
+        self.updated_at = data["updated_at"]
+        if self.view is not None:
+            self.view.sync()  # 表示中なら表示も合わせる
+
+class TaskView(Container):  # タスク1行分の表示（Containerを継承、別のタスクに付け替えて使い回す）
+    def __init__(self, task_status_change, task_delete, lock, page=None):
+        super().__init__()  # 親クラスの初期化
+        self.page = page  # ページ参照（編集時に必要）
+        self.lock = lock  # セッションの排他（UiMeter.lock）
+        self.task = None  # 表示しているタスク
+        self.task_status_change = task_status_change  # 状態変更時のコールバック
+        self.task_delete = task_delete  # 削除時のコールバック
 
         self.is_editing = False  # 編集モードかどうか
-
-        self.update_label = Text(f"編集: {self.updated_at}", size=8, color=Colors.GREY)  # 編集日時ラベル
-        self.edit_name = TextField(expand=1, multiline=True)  # 編集用テキストフィールド
-        self.edit_tag = ft.Dropdown(  # 編集用のタグ選択ドロップダウン（未使用）
-            options=[],
-            value=self.tag,
-            width=120
-        )
+        self.edit_view = None  # 編集ビュー（最初に編集するときに作る）
+        self.edit_name = None  # 編集用テキストフィールド
+        self.edit_tag = None  # 編集用のタグ選択ドロップダウン（未使用）
+        self.delete_button = None  # 削除ボタン（最初に長押しされたときに作る）
         self.show_delete = False  # 削除ボタン表示フラグ
         self.highlighted = False  # ハイライト状態
         self.bgcolor = None  # 背景色
         self.padding = 5  # パディング
         self.border_radius = 5  # 角丸
 
-        # 削除ボタン（初期状態では非表示）
-        self.delete_button = IconButton(icon=Icons.DELETE_OUTLINE, tooltip="削除", on_click=self.delete_clicked)
+        self.update_label = Text("", size=8, color=Colors.GREY)  # 編集日時ラベル
 
         # タスク名ボタン（クリックで編集、長押しで削除ボタン表示）
         self.task_label_button = ft.TextButton(
-            content=Text(self.task_name, max_lines=1, overflow="ellipsis", width=200),
+            content=Text("", max_lines=1, overflow="ellipsis", width=200),
             on_click=self.edit_clicked,
             on_long_press=self.toggle_delete_icon,
         )
@@ -111,6 +1417,8 @@ class Task(Container):  # タスクを表すコンポーネント（Containerを
             on_change=self.status_changed,
         )
 
+        self.delete_switcher = ft.AnimatedSwitcher(content=ft.Container())  # 削除ボタンの表示切り替え
+
         # 通常表示ビュー（表示中のラベルや削除ボタン）
         self.display_view = Row(
             alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
@@ -118,13 +1426,43 @@ class Task(Container):  # タスクを表すコンポーネント（Containerを
             controls=[
                 Row(spacing=10, controls=[self.checkbox, self.task_label_button]),  # 左側（チェック+名前）
                 Row(spacing=5, controls=[  # 右側（削除ボタン・更新日ラベル）
-                    ft.AnimatedSwitcher(content=self.delete_button if self.show_delete else ft.Container()),
+                    self.delete_switcher,
                     self.update_label,
                 ])
             ]
         )
 
-        # 編集ビュー（非表示）
+        self.content = Column(controls=[self.display_view])  # 表示ビュー（編集ビューは編集時に追加）
+        self.content.expand = True  # 自動で広がる
+        self.content.padding = 0
+        self.controls = [self.content]  # Containerに表示する中身として設定
+
+    def is_isolated(self):  # 親の更新時に中身を走査しない（タスクの中身はタスク自身の更新で送る）
+        return True
+
+    def bind(self, task):  # このビューでタスクを表示する（使い回す前の状態は捨てる）
+        self.task = task
+        task.view = self
+        if self.is_editing:
+            self.close_edit()
+        if self.show_delete:
+            self.toggle_delete(False)
+        self.sync()
+
+    def unbind(self):  # タスクの表示をやめる
+        if self.is_editing and self.page is not None and self.page.on_click == self.on_page_click:
+            self.page.on_click = None  # 編集中だった場合は外側クリックの処理を外す
+        self.task.view = None
+        self.task = None
+
+    def sync(self):  # タスクの内容を表示に反映
+        self.checkbox.value = self.task.completed  # チェック状態
+        self.task_label_button.content.value = self.task.task_name  # 表示名
+        self.update_label.value = f"編集: {self.task.updated_at}"  # 編集日時ラベル
+
+    def build_edit_view(self):  # 編集ビューを作る（編集されないタスクには作らない）
+        self.edit_name = TextField(expand=1, multiline=True)  # 編集用テキストフィールド
+        self.edit_tag = ft.Dropdown(options=[], width=120)  # 編集用のタグ選択ドロップダウン（未使用）
         self.edit_view = Row(
             visible=False,  # 初期は非表示
             alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
@@ -134,74 +1472,110 @@ class Task(Container):  # タスクを表すコンポーネント（Containerを
                 ft.IconButton(icon=Icons.DONE_OUTLINE_OUTLINED, icon_color=Colors.GREEN, on_click=self.save_clicked)  # 保存ボタン
             ]
         )
+        self.content.controls.append(self.edit_view)
 
-        self.content = Column(controls=[self.display_view, self.edit_view])  # 表示と編集ビューをまとめたColumn
-        self.content.expand = True  # 自動で広がる
-        self.content.padding = 0
-        self.controls = [self.content]  # Containerに表示する中身として設定
-
-    def set_tag_options(self, tag_list):  # タグ選択肢を更新
-        self.edit_tag.options = [ft.dropdown.Option(t) for t in tag_list]  # 選択肢を設定
-        if self.tag in tag_list:
-            self.edit_tag.value = self.tag  # 現在のタグに合わせる
+    def set_tag_options(self, tags):  # タグ選択肢を更新（tags: [(id, 名前), ...]）
+        self.edit_tag.options = [ft.dropdown.Option(key=str(tag_id), text=name) for tag_id, name in tags]  # 選択肢を設定（値はid）
+        if any(tag_id == self.task.tag_id for tag_id, _ in tags):
+            self.edit_tag.value = str(self.task.tag_id)  # 現在のタグに合わせる
         else:
-            self.edit_tag.value = tag_list[0] if tag_list else None  # 無効なら先頭タグを設定
-        self.update()  # 表示更新
+            self.edit_tag.value = str(tags[0][0]) if tags else None  # 無効なら先頭タグを設定
 
     def edit_clicked(self, e):  # 編集モードに入る処理
-        self.is_editing = True  # 編集中フラグを立てる
-        self.edit_name.value = self.task_name  # 現在の名前をセット
-        self.display_view.visible = False  # 表示ビューを非表示
-        self.edit_view.visible = True  # 編集ビューを表示
-        self.set_tag_options(self.page.todo_app.tag_list)  # タグを更新
-        self.update()  # 表示更新
-        self.page.on_click = self.on_page_click  # 外側クリックで終了処理を設定
+        with self.lock:
+            if self.edit_view is None:
+                self.build_edit_view()
+            self.is_editing = True  # 編集中フラグを立てる
+            self.edit_name.value = self.task.task_name  # 現在の名前をセット
+            self.display_view.visible = False  # 表示ビューを非表示
+            self.edit_view.visible = True  # 編集ビューを表示
+            self.set_tag_options(self.page.todo_app.tags)  # タグを更新
+            self.update()  # 表示更新
+            self.page.on_click = self.on_page_click  # 外側クリックで終了処理を設定
 
     def on_page_click(self, e):  # ページクリック時の処理
-        if self.is_editing:
-            if e.control in [self.edit_name, self.edit_tag]:  # 編集欄をクリックした場合は無視
-                return
-            self.save_clicked(None)  # 保存処理を呼び出し
-            self.page.on_click = None  # イベント解除
-
-    def save_clicked(self, e):  # 編集内容を保存
-        new_name = self.edit_name.value.strip()  # 新しい名前
-        new_tag = self.edit_tag.value  # 新しいタグ
-        if new_name:  # 名前が空でなければ保存
-            self.task_name = new_name
-            self.tag = new_tag
-            self.task_label_button.content.value = new_name  # 表示名更新
-            self.updated_at = datetime.now().strftime("%m月%d日")  # 更新日を現在時刻に
-            self.update_label.value = f"編集: {self.updated_at}"  # ラベル更新
+        with self.lock:
+            if self.is_editing:
+                if e.control in [self.edit_name, self.edit_tag]:  # 編集欄をクリックした場合は無視
+                    return
+                self.save_clicked(None)  # 保存処理を呼び出し
+                self.page.on_click = None  # イベント解除
+
+    def close_edit(self):  # 編集ビューを閉じて表示ビューに戻す
         self.display_view.visible = True  # 表示ビューを表示
         self.edit_view.visible = False  # 編集ビューを非表示
         self.is_editing = False  # 編集フラグ解除
-        self.update()
-        self.task_status_change(self)  # 外部に通知（DB保存など）
+
+    def save_clicked(self, e):  # 編集内容を保存
+        with self.lock:
+            task = self.task
+            new_name = self.edit_name.value.strip()  # 新しい名前
+            new_tag = self.edit_tag.value  # 新しいタグ（idの文字列）
+            if new_name:  # 名前が空でなければ保存
+                task.task_name = new_name
+                task.tag_id = int(new_tag) if new_tag not in (None, "None") else None
+                task.updated_at = datetime.now().strftime("%m月%d日")  # 更新日を現在時刻に
+                self.sync()  # 表示名・ラベル更新
+            self.close_edit()
+            self.update()
+            self.task_status_change(task)  # 外部に通知（DB保存など）
 
     def status_changed(self, e):  # チェックボックスの状態が変わった時
-        self.completed = self.checkbox.value  # 完了状態更新
-        self.task_status_change(self)  # 外部に通知
+        with self.lock:
+            self.task.completed = self.checkbox.value  # 完了状態更新
+            self.task_status_change(self.task)  # 外部に通知
 
     def delete_clicked(self, e):  # 削除ボタンがクリックされた時
-        self.task_delete(self)  # 外部に通知
+        with self.lock:
+            self.task_delete(self.task)  # 外部に通知
+
+    def toggle_delete(self, show):  # 削除ボタンの表示を切り替える
+        if show and self.delete_button is None:
+            self.delete_button = IconButton(icon=Icons.DELETE_OUTLINE, tooltip="削除", on_click=self.delete_clicked)
+        self.show_delete = show  # 表示フラグ切り替え
+        self.highlighted = show  # ハイライト状態も同時に切り替え
+        self.bgcolor = Colors.AMBER_100 if show else None  # 背景色を変更
+        self.delete_switcher.content = self.delete_button if show else ft.Container()
 
     def toggle_delete_icon(self, e):  # 長押しで削除ボタンの表示切り替え
-        self.show_delete = not self.show_delete  # 表示フラグ切り替え
-        self.highlighted = self.show_delete  # ハイライト状態も同時に切り替え
-        self.bgcolor = Colors.AMBER_100 if self.highlighted else None  # 背景色を変更
-        self.update()
+        with self.lock:
+            self.toggle_delete(not self.show_delete)
+            self.update()
+
+class TaskViews:  # 画面に出すタスクにだけTaskViewを割り当て、画面から外れたビューを使い回すクラス
+    def __init__(self, page, task_status_change, task_delete, lock, max_free=TASK_PAGE_SIZE):
+        self.page = page
+        self.lock = lock  # ビューのイベントで取るセッションの排他
+        self.task_status_change = task_status_change
+        self.task_delete = task_delete
+        self.max_free = max_free  # 使い回し用に取っておくビューの上限
+        self.free = []  # 画面から外れて空いているビュー
+
+    def get(self, task):  # タスクのビューを返す（無ければ空いているビューを付け替える、それも無ければ作る）
+        if task.view is None:
+            view = self.free.pop() if self.free else TaskView(self.task_status_change, self.task_delete, self.lock)
+            view.page = self.page
+            view.bind(task)
+        return task.view
+
+    def release(self, views):  # 画面から外れたビューを回収（送信後に呼ぶ：同じ送信の中で別のタスクに付け替えないように）
+        for view in views:
+            if view.task is not None and view.task.view is view:
+                view.unbind()
+            if len(self.free) < self.max_free:
+                self.free.append(view)
 
 #──────────────────────────────
 # タグ管理ダイアログ
 #──────────────────────────────
 class TagManager(AlertDialog):  # Fletのダイアログを継承したクラス
-    def __init__(self, tag_list, on_tags_updated):  # tag_list: 現在のタグ一覧, on_tags_updated: タグ更新時のコールバック関数
+    def __init__(self, tags, on_tags_updated, lock):  # tags: 現在のタグ一覧 [(id, 名前), ...], on_tags_updated: タグ更新時のコールバック関数, lock: セッションの排他
         super().__init__()  # 親クラスの初期化
+        self.lock = lock
         self.title = Text("タグ管理", size=20)  # ダイアログのタイトル
         self.on_tags_updated = on_tags_updated  # タグ更新通知用のコールバックを保存
 
-        self.tag_list = tag_list.copy()  # 渡されたタグ一覧をコピーして保持（元を壊さない）
+        self.tag_list = [[tag_id, name] for tag_id, name in tags]  # [id, 名前] の組をコピーして保持（新しいタグのidはNone）
 
         self.tag_inputs = []  # テキスト入力欄を格納するリスト
         self.container = Column(spacing=5, scroll="auto", height=250)  # 入力欄の列（スクロール可能）
@@ -221,62 +1595,73 @@ class TagManager(AlertDialog):  # Fletのダイアログを継承したクラス
 
         self.update_tag_list()  # 初期のタグ入力欄を生成
 
-    def update_tag_list(self):  # 入力欄の一覧を更新
+    def update_tag_list(self):  # 入力欄の一覧を作り直す
         self.container.controls.clear()  # 一度すべての入力欄を消す
         self.tag_inputs.clear()  # 入力欄リストも空に
+        for _, name in self.tag_list:  # タグごとに処理
+            self.container.controls.append(self.create_tag_row(name))  # UIに追加
 
-        for idx, tag in enumerate(self.tag_list):  # タグごとに処理
-            tf = TextField(value=tag, width=200)  # 入力欄を作成（タグ名を初期値に）
-            tf.tag_index = idx  # 入力欄にインデックスを付ける（後で変更・削除に使う）
-            tf.on_change = self.tag_text_changed  # テキスト変更時の処理を設定
+    def create_tag_row(self, name):  # タグ1件分の入力欄＋削除ボタンの行を作る
+        tf = TextField(value=name, width=200)  # 入力欄を作成（タグ名を初期値に）
+        tf.on_change = self.tag_text_changed  # テキスト変更時の処理を設定
 
-            del_btn = IconButton(icon=Icons.DELETE, tooltip="タグ削除", on_click=self.delete_tag)  # 削除ボタンを作成
-            del_btn.tag_index = idx  # こちらにもインデックスを付ける
+        del_btn = IconButton(icon=Icons.DELETE, tooltip="タグ削除", on_click=self.delete_tag)  # 削除ボタンを作成
+        del_btn.data = tf  # どの入力欄の行かを覚えておく（位置は削除で変わるため）
 
-            row = Row([tf, del_btn], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)  # 入力欄＋削除ボタンを1行にまとめる
-            self.tag_inputs.append(tf)  # 入力欄をリストに追加
-            self.container.controls.append(row)  # UIに追加
+        self.tag_inputs.append(tf)  # 入力欄をリストに追加
+        return Row([tf, del_btn], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)  # 入力欄＋削除ボタンを1行にまとめる
 
     def tag_text_changed(self, e):  # テキスト変更時の処理
-        idx = e.control.tag_index  # どの入力欄か取得
-        new_val = e.control.value.strip()  # 入力値の前後の空白を除去
-        if new_val:  # 空でなければ
-            self.tag_list[idx] = new_val  # タグリストを更新
+        with self.lock:
+            idx = self.tag_inputs.index(e.control)  # どの入力欄か取得
+            new_val = e.control.value.strip()  # 入力値の前後の空白を除去
+            if new_val and all(name != new_val for _, name in self.tag_list):  # 空でなく他のタグと重複しなければ
+                self.tag_list[idx][1] = new_val  # 名前だけを更新（idは変わらないのでタスクの付け替えは不要）
 
     def delete_tag(self, e):  # タグ削除ボタンが押されたときの処理
-        idx = e.control.tag_index  # 押されたボタンのインデックス取得
-        del self.tag_list[idx]  # 指定インデックスのタグを削除
-        self.update_tag_list()  # 入力欄を更新して再描画
+        with self.lock:
+            idx = self.tag_inputs.index(e.control.data)  # 押されたボタンの行の位置を取得
+            del self.tag_list[idx]  # 指定位置のタグを削除
+            del self.tag_inputs[idx]
+            del self.container.controls[idx]  # その行だけを取り除く
+            self.container.update()  # 削除された行だけが送られる
 
     def add_new_tag(self, e):  # 新しいタグを追加する処理
-        new_tag = self.new_tag_field.value.strip()  # 入力されたタグ名
-        if new_tag and new_tag not in self.tag_list:  # 空でなく重複もしていなければ
-            self.tag_list.append(new_tag)  # タグを追加
-            self.new_tag_field.value = ""  # 入力欄をクリア
-            self.update_tag_list()  # 入力欄を更新
+        with self.lock:
+            new_tag = self.new_tag_field.value.strip()  # 入力されたタグ名
+            if new_tag and all(name != new_tag for _, name in self.tag_list):  # 空でなく重複もしていなければ
+                self.tag_list.append([None, new_tag])  # タグを追加（idは保存時に採番）
+                self.new_tag_field.value = ""  # 入力欄をクリア
+                self.container.controls.append(self.create_tag_row(new_tag))  # 追加した行だけを作る
+                self.page.update(self.container, self.new_tag_field)  # 追加行と入力欄を1回で送る
 
     def close_dialog(self, e):  # 閉じるボタン押下時の処理
-        self.on_tags_updated(self.tag_list)  # 更新後のタグをコールバックで通知
-        self.open = False  # ダイアログを閉じる
-        self.update()  # 表示更新
+        with self.lock:
+            self.on_tags_updated(self.tag_list)  # 更新後のタグをコールバックで通知
+            self.open = False  # ダイアログを閉じる
+            self.update()  # 表示更新
 
 #──────────────────────────────                          # 区切り線（視認性のための装飾）
 # Todo アプリ全体                                         # アプリ本体を構成するクラス
 #──────────────────────────────
 class TodoApp(Column):                                    # Flet の Column を継承して UI を縦に並べる
-    def __init__(self, page):                             # 初期化（page: Fletのページオブジェクト）
+    def __init__(self, page, owner=""):                   # 初期化（page: Fletのページオブジェクト, owner: タスクの所有者）
         super().__init__()                                # 親クラスの初期化
 
         self.page = page                                  # ページオブジェクトを保持
-        self.tag_list = DEFAULT_TAGS.copy()               # デフォルトタグのコピーを保持
+        self.owner = owner                                # このセッションの利用者（DBの読み書きはこの所有者の行だけ）
+        self.tags = []                                    # タグ一覧 [(id, 名前), ...]（DBから読み込む）
+        self.ui = UiPatch(page)                           # 変更されたコントロールだけをまとめて送る
+        self.meter = UiMeter(page)                        # 操作ごとの送信量を計測
 
         self.tag_manager_button = ElevatedButton(text="タグ管理", icon=Icons.LABEL, on_click=self.open_tag_manager)  # タグ管理ダイアログ起動ボタン
 
         self.tag_tabs = Tabs(                             # タグ別フィルタ用タブ
             selected_index=0,                             # 最初に選ばれているタブ（先頭）
             on_change=self.filter_changed,                # タブ変更時の処理
-            tabs=[Tab(text=t) for t in self.tag_list]     # タグ名からタブを作成
+            tabs=[]                                       # タブはタグ一覧を読み込んでから作る
         )
+        self.tab_tags = []                                # 各タブがどのタグidのものか（タブの使い回し用）
 
         self.status_tabs = Tabs(                          # ステータス（アクティブ/完了）フィルタ用タブ
             selected_index=0,                             # 最初に「アクティブ」を選択
@@ -285,9 +1670,31 @@ class TodoApp(Column):                                    # Flet の Column を
         )
 
         self.new_task = TextField(hint_text="ここに内容記入", on_submit=self.add_clicked, expand=True, multiline=True)  # 新規タスク入力欄
-
-        self.all_tasks = []                               # 全タスクを保持するリスト
-        self.tasks = Column(spacing=10, expand=True)      # フィルタ済みタスクを表示するColumn
+        self.search_box = TextField(                      # タスク名の検索欄（入力が止まったら検索）
+            hint_text="タスクを検索", prefix_icon=Icons.SEARCH, on_change=self.search_changed, on_submit=self.search_changed
+        )
+        self.search_query = ""                            # 表示中の検索語（空なら通常の一覧）
+        self.search_results = []                          # 検索結果のタスク（似ている順）
+        self.search_after = None                          # 検索結果の次のページの開始位置（スコア, id）
+        self.search_done = True                           # 検索結果を最後まで読んだかどうか
+        self.search_seq = 0                               # 入力のたびに増やす番号（古い入力の検索を捨てる）
+        self.search_timer = None                          # 入力待ちのタイマー
+
+        self.store = TaskStore()                          # DBから読み込んだタスクを索引付きで保持するストア
+        self.cursors = {}                                 # (タグ, 完了状態) -> DBから読み込んだ最後のidと、読み切ったかどうか
+        self.origin = uuid.uuid4().hex                    # このセッションの識別子（自分の変更通知を見分ける）
+        self.changes = TaskChanges(                       # 未保存の変更を追跡（バックグラウンドで必要な行だけ保存）
+            self.owner, on_saved=self.changes_saved, on_error=self.changes_failed, origin=self.origin
+        )
+        self.tasks = Column(spacing=10, expand=True)      # フィルタ済みタスクのうち表示中のページ分だけを持つColumn
+        self.views = TaskViews(page, self.task_status_change, self.task_delete, self.meter.lock)  # 表示中のタスクにだけ割り当てるビュー
+        self.visible_tasks = []                           # 現在のフィルター条件に一致する全タスク（画面に出すのは先頭から一部）
+        self.current_filter = None                        # 直前に表示したフィルター条件（タグ, ステータス）
+        self.load_more_button = ft.TextButton(            # 次のページを表示するボタン
+            text="もっと見る", icon=Icons.EXPAND_MORE, on_click=self.load_more_clicked, visible=False
+        )
+        self.loading = ft.ProgressBar(visible=True)       # 起動時の読み込み中表示（最初のタスクが揃うまで出す）
+        self.loaded = threading.Event()                   # 起動時の読み込みが終わったか（ベンチマークが待つ）
 
         self.width = 700                                  # アプリ全体の幅
 
@@ -295,13 +1702,16 @@ class TodoApp(Column):                                    # Flet の Column を
             Row([Text("タグ付きToDoリスト", theme_style=ft.TextThemeStyle.HEADLINE_MEDIUM)],  # タイトル行
                 alignment=ft.MainAxisAlignment.CENTER),
             Row([self.new_task, IconButton(icon=Icons.ADD, on_click=self.add_clicked)]),      # 入力欄と追加ボタン
+            self.search_box,                                                                   # 検索欄
             Row([self.tag_tabs, self.tag_manager_button]),                                     # タグフィルターとタグ管理ボタン
             self.status_tabs,                                                                  # ステータスタブ
             Column(                                                                            # メインの表示エリア
                 spacing=25,
                 expand=True,
                 controls=[
+                    self.loading,                                                              # 読み込み中表示
                     self.tasks,                                                                # タスク一覧
+                    Row([self.load_more_button], alignment=ft.MainAxisAlignment.CENTER),       # 続きを表示するボタン
                     Row(
                         alignment=ft.MainAxisAlignment.END,
                         controls=[
@@ -313,119 +1723,476 @@ class TodoApp(Column):                                    # Flet の Column を
         ]
 
     def open_tag_manager(self, e):                         # タグ管理ボタンが押されたとき
-        self.tag_manager = TagManager(self.tag_list, self.on_tags_updated)  # ダイアログ作成（現在のタグと更新コールバックを渡す）
-        self.page.dialog = self.tag_manager                # ページにダイアログをセット
-        self.tag_manager.open = True                       # ダイアログを開く
-        self.page.update()                                 # UI更新
-
-    def on_tags_updated(self, new_tags):                   # タグが更新されたときに呼ばれる
-        if not new_tags:                                   # 空のタグリストなら
-            new_tags = ["その他"]                           # デフォルトのタグを追加
-        self.tag_list = new_tags                           # 新しいタグリストを保存
-
-        # タブ再構築
-        self.tag_tabs.tabs.clear()                         # 既存のタブをクリア
-        for t in self.tag_list:                            # 新しいタグごとにタブを作る
-            self.tag_tabs.tabs.append(Tab(text=t))
-        self.tag_tabs.selected_index = 0                   # 先頭のタブを選択
-        self.tag_tabs.update()                             # タブ更新
-
-        # タスクタグが存在しないタグなら「その他」に変更
-        for task in self.all_tasks:
-            if task.tag not in self.tag_list:              # タグが無効になった場合
-                task.tag = "その他"                         # タグを「その他」に変更
-                task.update()                              # タスクUI更新
-
-        self.filter_tasks()                                # フィルタを再適用
-        self.page.update()                                 # ページ全体更新
-
-    def reload_tasks_from_db(self):                        # DBからタスクを読み込む
-        self.all_tasks.clear()                             # 現在のタスクリストをクリア
-        for data in load_tasks_from_db():                  # DBからデータ取得
-            task = self.create_task_from_data(data)        # 各データを Task に変換
-            self.all_tasks.append(task)
-        self.filter_tasks()                                # フィルタ適用して表示更新
-
-    def create_task_from_data(self, data):                 # DBデータから Task インスタンスを生成
-        task = Task(
+        with self.meter.interaction("open_tag_manager"):
+            tags = [t for t in self.tags if t[0] is not None]  # 表示用の「その他」は編集対象にしない
+            self.tag_manager = TagManager(tags, self.on_tags_updated, self.meter.lock)  # ダイアログ作成（現在のタグと更新コールバックを渡す）
+            self.page.dialog = self.tag_manager                # ページにダイアログをセット
+            self.tag_manager.open = True                       # ダイアログを開く
+            self.page.update()                                 # UI更新
+
+    def on_tags_updated(self, new_tags):                   # タグが更新されたときに呼ばれる（new_tags: [[id または None, 名前], ...]）
+        with self.meter.interaction("on_tags_updated"):
+            try:
+                old_tags = [t for t in self.tags if t[0] is not None]
+                tags = save_tags_to_db(self.owner, old_tags, new_tags, self.origin)  # 変わったタグの行だけを1トランザクションで保存
+            except psycopg2.Error as ex:
+                logger.warning("タグの保存に失敗しました: %s", ex)
+                self.show_message("タグの保存に失敗しました")
+                return
+
+            # 削除されたタグのタスクは「その他」に変更（DB側は外部キーのON DELETE SET NULLで付け替え済み）
+            for tag_id in self.store.tags() - {tag_id for tag_id, _ in tags} - {None}:
+                for task in self.store.filter(tag_id, False) + self.store.filter(tag_id, True):
+                    task.tag_id = None                         # タグを「その他」に変更
+                    self.store.reindex(task)                   # 索引を付け替える（タグは行に表示しないので送信不要）
+                self.cursors.pop((None, False), None)          # 「その他」は読み込み済みより前のidも増えたので読み直す
+                self.cursors.pop((None, True), None)
+
+            self.set_tags(tags)                                # タブを差分で作り直す
+            self.ui.set(self.tag_tabs, selected_index=0)       # 先頭のタブを選択
+            self.filter_tasks()                                # フィルタを再適用（変わったコントロールだけ送信）
+
+    def set_tags(self, tags):                              # タグ一覧を差し替えてタブを作り直す
+        self.tags = list(tags) or [(None, "その他")]       # タグが1つも無ければ「その他」だけを表示
+        # 残ったタグのタブは使い回し、追加・削除されたタブだけを送る（名前の変更はタブの文字だけを送る）
+        tabs_by_id = dict(zip(self.tab_tags, self.tag_tabs.tabs))
+        self.ui.sync_list(self.tag_tabs, [tabs_by_id.get(tag_id) or Tab(text=name) for tag_id, name in self.tags], attr="tabs")
+        self.tab_tags = [tag_id for tag_id, _ in self.tags]  # 各タブがどのタグidのものか
+        if not 0 <= self.tag_tabs.selected_index < len(self.tags):
+            self.ui.set(self.tag_tabs, selected_index=0)
+
+    def reload_tasks_from_db(self):                        # DBからタグ一覧とタスクを読み込む（タスクは表示中のフィルターの先頭ページだけ）
+        self.set_tags(load_tags_from_db(self.owner))       # タグ一覧はタスクと一緒に1回だけ読み込む
+        previous = self.store, self.cursors, self.current_filter
+        self.clear_store()                                 # 現在のタスクをクリア（未保存のタスクは残す）
+        self.current_filter = None
+        try:
+            self.filter_tasks()                            # フィルタ適用して表示更新（必要な分だけDBから取得）
+        except psycopg2.Error:
+            self.store, self.cursors, self.current_filter = previous  # 読めなければ表示中の一覧のストアに戻す
+            raise
+        self.ui.set(self.loading, visible=False)           # 起動時の読み込みに失敗していても読み直せたら隠す
+        self.ui.commit()
+
+    def clear_store(self):                                 # 読み込んだタスクと読み込み位置を捨てる（読み直し用）
+        self.store = TaskStore()                           # 元のストアは読み直しに失敗したときに戻せるよう残す
+        self.cursors = {}                                  # 読み込み位置をリセット
+        for task in self.changes.saving_tasks():           # 未保存のタスクは残す（保存後の変更通知は自分の分として無視されるため）
+            self.store.add(task, last=True)                # 保存されればidは最後尾なので、読み込む行より後ろに並べる
+
+    def load_progressively(self):                          # 画面を出した後にタグとタスクを少しずつ読み込んで順に表示（別スレッドで呼ぶ）
+        try:
+            with self.meter.interaction("initial_load"):
+                self.set_tags(load_tags_from_db(self.owner))   # タブを先に確定させる
+                self.clear_store()
+                self.current_filter = None
+                tag, completed = self.selected_filter()        # 開いているタブ（最初は「アクティブ」）の分から読む
+                while (self.store.count(tag, completed) < TASK_PAGE_SIZE
+                       and self.fetch_page(tag, completed, LOAD_CHUNK_SIZE)):
+                    self.filter_tasks(load=False)              # 読めた分だけ先に描画
+                self.ui.set(self.loading, visible=False)
+                self.filter_tasks()                            # 1ページ分に揃えて件数表示も確定
+        except psycopg2.Error as ex:
+            self.load_failed(ex, self.load_progressively)
+        finally:
+            self.loaded.set()
+
+    def load_failed(self, ex, retry):                      # DBから読めなかったことを知らせる（表示はそのまま、再試行ボタン付き）
+        logger.warning("タスクの読み込みに失敗しました: %s", ex)
+        self.show_message("タスクを読み込めませんでした", action="再読み込み",
+                          on_action=lambda e: self.page.run_thread(retry))
+
+    def fetch_page(self, tag, completed, limit=TASK_PAGE_SIZE):  # 指定フィルターの次のページをDBから読み込んでストアに追加
+        cursor = self.cursors.setdefault((tag, completed), {"after": None, "done": False})
+        if cursor["done"]:                                 # 読み切っていれば何もしない
+            return 0
+        rows = query_tasks(self.owner, tag, completed, cursor["after"], limit)  # 索引を使ったキーセットページング
+        deleted = self.changes.deleted_ids()               # 削除の保存待ちでまだDBに残っている行
+        for data in rows:
+            cursor["after"] = data["id"]                   # 次のページはこのidより後ろから
+            if self.store.get(data["id"]) is None and data["id"] not in deleted:  # 移動済み・追加済み・削除済みは読み直さない
+                self.store.add(self.find_search_result(data["id"]) or self.create_task_from_data(data))  # 検索で作ったタスクは使い回す
+        if len(rows) < limit:                              # 1ページに満たなければ最後まで読んだ
+            cursor["done"] = True
+        return len(rows)
+
+    def ensure_loaded(self, tag, completed, count):        # 表示に必要な件数がストアに揃うまでDBから読み込む
+        while self.store.count(tag, completed) < count and self.fetch_page(tag, completed):
+            pass
+
+    def fully_loaded(self, tag, completed):                # 指定フィルターのタスクをDBから読み切ったかどうか
+        cursor = self.cursors.get((tag, completed))
+        return cursor is not None and cursor["done"]
+
+    def create_task_from_data(self, data):                 # DBデータから Task を生成（コントロールは表示するときに割り当てる）
+        return Task(
             task_name=data["name"],
-            task_status_change=self.task_status_change,
-            task_delete=self.task_delete,
-            tag=data.get("tag", "その他"),
+            tag_id=data.get("tag_id"),
+            completed=data["completed"],
             created_at=data.get("created_at"),
             updated_at=data.get("updated_at"),
-            page=self.page
+            task_id=data.get("id")
         )
-        task.checkbox.value = data["completed"]            # チェック状態設定
-        task.completed = data["completed"]
-        return task
 
     def add_clicked(self, e):  # タスク追加ボタンがクリックされたときの処理
-        name = self.new_task.value.strip()  # 入力されたタスク名を取得（前後の空白除去）
-        if 0 <= self.tag_tabs.selected_index < len(self.tag_list):  # 選択されているタグのインデックスが有効か確認
-            tag = self.tag_list[self.tag_tabs.selected_index]  # 選択されたタグを取得
-        else:
-            tag = "その他"  # 無効な場合は「その他」タグを使用
-
-        if name:  # タスク名が空でない場合に処理を実行
-            task = Task(name, self.task_status_change, self.task_delete, tag=tag, page=self.page)  # 新しいタスクを作成
-            self.all_tasks.append(task)  # タスクリストに追加
-            self.new_task.value = ""  # 入力フィールドをクリア
-            self.new_task.focus()  # 入力フィールドにフォーカスを戻す
-            self.filter_tasks()  # タスク表示をフィルターに基づいて更新
-            save_tasks_to_db(self.all_tasks)  # 全タスクをデータベースに保存
+        with self.meter.lock:
+            name = self.new_task.value.strip()  # 入力されたタスク名を取得（前後の空白除去）
+            if 0 <= self.tag_tabs.selected_index < len(self.tags):  # 選択されているタグのインデックスが有効か確認
+                tag_id = self.tags[self.tag_tabs.selected_index][0]  # 選択されたタグのidを取得
+            else:
+                tag_id = None  # 無効な場合は「その他」タグを使用
+
+            if name:  # タスク名が空でない場合に処理を実行
+                with self.meter.interaction("add_clicked"):
+                    task = Task(name, tag_id=tag_id)  # 新しいタスクを作成
+                    self.store.add(task)  # ストアに追加
+                    self.ui.set(self.new_task, value="")  # 入力フィールドをクリア
+                    self.new_task.focus()  # 入力フィールドにフォーカスを戻す
+                    self.changes.mark_new(task)  # 新規タスクとして記録
+                    self.save_changes()  # INSERTを予約（直後の編集と1回にまとまる）
+                    self.filter_tasks()  # タスク表示をフィルターに基づいて更新（入力欄のクリアも同じ送信に含める）
+
+    def save_changes(self):  # 記録した変更の保存を予約（すぐに戻り、保存はバックグラウンドで行う）
+        write_behind.schedule(self.changes)
+
+    def changes_saved(self, tasks, recovered):  # 保存が終わったとき（保存ワーカーのスレッドから呼ばれる）
+        self.page.run_thread(self.apply_saved, tasks, recovered)  # 全セッション共通のワーカーをこのセッションの排他で待たせない
+
+    def apply_saved(self, tasks, recovered):  # 保存結果をストアと画面に反映（このセッションのスレッドで呼ぶ）
+        with self.meter.lock:
+            for task in tasks:
+                if task in self.store.keys:  # 保存中に削除・読み直しで外れたタスクはidの索引にも入れない（DBの行は読み込みで入る）
+                    self.store.index_id(task)  # 採番されたidを索引に登録
+            if recovered:
+                self.show_message("保存しました")  # 失敗していた変更が保存できた
+
+    def changes_failed(self, ex, retry_in):  # 保存に失敗したとき（保存ワーカーのスレッドから呼ばれる）
+        self.page.run_thread(
+            self.show_message,
+            f"保存に失敗しました。{retry_in:.0f}秒後に再試行します",
+            action="今すぐ再試行",
+            on_action=lambda e: write_behind.schedule(self.changes, 0)
+        )
 
-    def task_status_change(self, task):  # タスクの完了状態が変更されたときの処理
-        self.filter_tasks()  # タスク表示を更新
-        save_tasks_to_db(self.all_tasks)  # タスクの状態をデータベースに保存
+    def on_remote_changes(self, events):  # 変更通知を受け取ったとき（受信スレッドから呼ばれる）
+        events = [ev for ev in events if ev.get("origin") != self.origin]  # 自分の変更は反映済み
+        if events:
+            self.page.run_thread(self.apply_remote_changes, events)  # このセッションのスレッドで反映
+
+    def apply_remote_changes(self, events):  # 他のセッションの変更をストアと画面に差分で反映
+        try:
+            self.apply_events(events)
+        except psycopg2.Error as ex:  # 反映しきれなかった変更は読み直しで取り込む
+            self.load_failed(ex, lambda: self.apply_remote_changes([{"op": "RESYNC"}]))
+
+    def apply_events(self, events):  # 変更通知を順にストアへ反映して一覧を更新
+        with self.meter.interaction("remote_changes"):
+            for ev in events:
+                if ev["op"] == "RESYNC":  # 通知を取りこぼした・一括インポートされた場合は読み直す
+                    self.reload_tasks_from_db()
+                    return
+                if ev["op"] == "TAGS":  # タグ一覧が変わった（削除されたタグのタスクは行の変更通知で届く）
+                    self.set_tags(load_tags_from_db(self.owner))
+                    continue
+                data = ev.get("row")
+                task_id = data["id"] if data else ev["id"]
+                task = self.store.get(task_id) or self.find_search_result(task_id)  # 検索だけで読み込んだタスクも同じものを使う
+                if ev["op"] == "DELETE":
+                    if task is not None:
+                        self.store.remove(task)  # 削除されたタスクを外す（ストアに無ければ何もしない）
+                        if task in self.search_results:
+                            self.search_results.remove(task)  # 検索結果からも外す
+                    continue
+                if data is None:  # 通知に収まらなかった行はDBから取り直す
+                    data = get_task_from_db(self.owner, task_id)
+                    if data is None:
+                        continue
+                if task is None:  # 新しいタスク（または未読み込みだったタスク）
+                    self.store.add(self.create_task_from_data(data))
+                elif self.changes.is_pending(task):
+                    continue  # このセッションの未保存の変更を優先
+                else:
+                    task.refresh(data)  # 内容を更新
+                    if self.store.get(task_id) is task:
+                        self.store.reindex(task)  # 完了状態・タグの索引を付け替える
+                    else:
+                        self.store.add(task)  # 検索結果にだけあったタスクもストアに入れる（新しいタスクと同じ扱い）
+                    if task.view is not None:
+                        self.ui.mark(task.view)  # 表示中ならこのタスクの中身だけ送る
+            self.filter_tasks()  # 一覧を差分で更新
+
+    def show_message(self, message, action=None, on_action=None):  # 画面下部に通知を表示
+        with self.meter.lock:
+            self.page.open(ft.SnackBar(Text(message), action=action, on_action=on_action))
+
+    def task_status_change(self, task):  # タスクの完了状態・内容が変更されたときの処理
+        with self.meter.interaction("task_status_change"):
+            self.store.reindex(task)  # 完了状態・タグの索引を付け替える
+            self.changes.mark_dirty(task)  # 変更されたタスクとして記録（表示の読み込みに失敗しても保存されるよう先に）
+            self.save_changes()  # UPDATEを予約（続けて操作しても1回にまとまる）
+            self.filter_tasks()  # タスク表示を更新
 
     def task_delete(self, task):  # タスクが削除されたときの処理
-        if task in self.all_tasks:  # 指定されたタスクがリストに存在する場合
-            self.all_tasks.remove(task)  # タスクをリストから削除
-        self.filter_tasks()  # タスク表示を更新
-        save_tasks_to_db(self.all_tasks)  # データベースを更新
+        with self.meter.interaction("task_delete"):
+            self.store.remove(task)  # ストアと索引から削除
+            if task in self.search_results:
+                self.search_results.remove(task)  # 検索結果からも外す
+            self.changes.mark_deleted(task)  # 削除されたタスクとして記録
+            self.save_changes()  # DELETEを予約
+            self.filter_tasks()  # タスク表示を更新
 
     def filter_changed(self, e):  # ステータスやタグフィルターが変更されたときの処理
-        self.filter_tasks()  # タスク表示を更新
+        with self.meter.interaction("filter_changed"):
+            wanted = self.tag_tabs.selected_index, self.status_tabs.selected_index
+            try:
+                self.filter_tasks()  # タスク表示を更新
+            except psycopg2.Error as ex:  # 読めなければタブを表示中の一覧に戻す
+                self.restore_tabs()
+                self.ui.commit()
+                self.load_failed(ex, lambda: self.select_tabs(*wanted))
+
+    def restore_tabs(self):  # タブの選択を表示中の一覧（current_filter）に合わせる
+        if self.current_filter is None:
+            return
+        tag, completed = self.current_filter
+        if tag in self.tab_tags:
+            self.ui.set(self.tag_tabs, selected_index=self.tab_tags.index(tag))
+        self.ui.set(self.status_tabs, selected_index=1 if completed else 0)
+
+    def select_tabs(self, tag_index, status_index):  # タブを選び直して一覧を表示（読み込みの再試行用）
+        with self.meter.lock:
+            self.ui.set(self.tag_tabs, selected_index=tag_index)
+            self.ui.set(self.status_tabs, selected_index=status_index)
+            self.filter_changed(None)
 
     def clear_clicked(self, e):  # 「完了タスクをクリア」ボタンがクリックされたときの処理
-        self.all_tasks = [t for t in self.all_tasks if not t.completed]  # 完了していないタスクだけを残す
-        self.filter_tasks()  # タスク表示を更新
-        save_tasks_to_db(self.all_tasks)  # データベースを更新
-
-    def filter_tasks(self):  # 現在のフィルター条件に基づいてタスクを表示
-        self.tasks.controls.clear()  # 現在のタスク表示をクリア
-
-        if 0 <= self.tag_tabs.selected_index < len(self.tag_list):  # 有効なタグが選択されている場合
-            selected_tag = self.tag_list[self.tag_tabs.selected_index]  # 選択されたタグを取得
+        with self.meter.interaction("clear_clicked"):
+            for t in self.store.filter(ANY_TAG, True):  # 完了済みの索引だけを見る
+                self.store.remove(t)  # ストアから削除
+                self.changes.mark_deleted(t)  # 完了タスクを削除対象として記録
+            self.search_results = [t for t in self.search_results if not t.completed]  # 検索結果の完了タスクも外す
+            self.changes.add_statement(  # 読み込んでいない完了タスクもDB側でまとめて削除（自分の行だけ）
+                "DELETE FROM todos WHERE owner = %s AND completed", (self.owner,)
+            )
+            for tag_id in self.tab_tags + [None, ANY_TAG]:  # 完了タスクはもうDBに残っていない（保存前に読み直さないように）
+                self.cursors[(tag_id, True)] = {"after": None, "done": True}
+            self.save_changes()  # 完了タスクをまとめて削除
+            self.filter_tasks()  # タスク表示を更新
+
+    def search_changed(self, e):  # 検索欄が変わったとき（入力が止まるまで待ってから検索する）
+        with self.meter.lock:
+            self.search_seq += 1
+            if self.search_timer is not None:
+                self.search_timer.cancel()  # 前の入力の検索は取り消す
+            delay = 0 if e.name == "submit" else SEARCH_DEBOUNCE  # Enterならすぐ検索
+            self.search_timer = threading.Timer(delay, self.page.run_thread, (self.run_search, self.search_seq))
+            self.search_timer.daemon = True
+            self.search_timer.start()
+
+    def run_search(self, seq):  # 検索を実行して結果の先頭ページを表示（入力待ちのタイマーから呼ばれる）
+        if seq != self.search_seq:  # 待っている間に次の入力があった
+            return
+        with self.meter.interaction("search"):
+            self.search_query = (self.search_box.value or "").strip()
+            self.search_results = []
+            self.search_after = None
+            self.search_done = not self.search_query
+            self.current_filter = None  # 検索をやめたら通常の一覧を先頭ページから表示し直す
+            if self.search_query:
+                self.fetch_search_page(seq)
+            if seq == self.search_seq:  # 検索中に次の入力があれば表示しない
+                self.filter_tasks()
+
+    def fetch_search_page(self, seq=None):  # 検索結果の次のページをDBから読み込む（読み込み済みのタスクは使い回す）
+        try:
+            rows = search_tasks(self.owner, self.search_query, self.search_after, TASK_PAGE_SIZE)  # GIN索引で絞り込み、似ている順に取得
+        except psycopg2.Error as ex:
+            logger.warning("検索に失敗しました: %s", ex)
+            self.show_message("検索に失敗しました")
+            self.search_done = True
+            return
+        if seq is not None and seq != self.search_seq:
+            return
+        deleted = self.changes.deleted_ids()  # 削除の保存待ちでまだDBに残っている行
+        for data, position in rows:
+            self.search_after = position
+            if data["id"] not in deleted:
+                self.search_results.append(self.store.get(data["id"]) or self.create_task_from_data(data))
+        self.search_done = len(rows) < TASK_PAGE_SIZE  # 1ページに満たなければ最後まで読んだ
+
+    def find_search_result(self, task_id):  # 検索結果にあるタスクをidで探す（同じタスクのコントロールを2つ作らないように）
+        for task in self.search_results:
+            if task.id == task_id:
+                return task
+        return None
+
+    def show_search_results(self, limit):  # 検索結果を表示（読み込んだ分だけ）
+        self.ensure_search_loaded(limit)
+        self.visible_tasks = self.search_results
+        self.show_tasks(self.search_results[:limit])
+
+    def ensure_search_loaded(self, count):  # 表示に必要な件数の検索結果が揃うまで読み込む
+        while len(self.search_results) < count and not self.search_done:
+            self.fetch_search_page()
+
+    def selected_filter(self):  # 選択中のタブからフィルター条件（タグid, 完了か）を返す
+        if 0 <= self.tag_tabs.selected_index < len(self.tags):  # 有効なタグが選択されている場合
+            selected_tag = self.tags[self.tag_tabs.selected_index][0]  # 選択されたタグのidを取得
         else:
-            selected_tag = None  # 無効な場合はタグフィルターなし
-
-        selected_status = self.status_tabs.tabs[self.status_tabs.selected_index].text  # 選択中のステータス（アクティブ／完了）を取得
-
-        filtered = self.all_tasks  # フィルタリング対象の全タスク
-        if selected_tag:  # タグフィルターが指定されている場合
-            filtered = [t for t in filtered if t.tag == selected_tag]  # タグに一致するタスクのみ残す
-
-        if selected_status == "アクティブ":  # ステータスがアクティブの場合
-            visible_tasks = [t for t in filtered if not t.completed]  # 完了していないタスクだけ表示
+            selected_tag = ANY_TAG  # 無効な場合はタグフィルターなし
+        return selected_tag, self.status_tabs.selected_index == 1  # 「完了」タブが選ばれているか
+
+    def filter_tasks(self, load=True):  # 現在のフィルター条件に基づいてタスクを表示（load=Falseなら読み込み済みの分だけ）
+        if self.search_query:  # 検索中はタブに関係なく検索結果を表示
+            self.show_search_results(max(TASK_PAGE_SIZE, len(self.tasks.controls)))
+            return
+        selected_tag, show_completed = self.selected_filter()
+
+        # 同じフィルターのままなら、すでに開いているページ数を保つ（編集のたびに先頭へ戻らないように）
+        if (selected_tag, show_completed) == self.current_filter:
+            limit = max(TASK_PAGE_SIZE, len(self.tasks.controls))
         else:
-            visible_tasks = [t for t in filtered if t.completed]  # 完了済みタスクのみ表示
-
-        self.tasks.controls.extend(visible_tasks)  # フィルターされたタスクを表示用に追加
-        self.update()  # 画面を更新
-
+            limit = TASK_PAGE_SIZE
+
+        if load:
+            self.ensure_loaded(selected_tag, show_completed, limit)  # 表示する分だけDBから読み込む
+        self.current_filter = (selected_tag, show_completed)  # 読み込めてから切り替える（失敗したら前の一覧のまま）
+        visible_tasks = self.store.filter(selected_tag, show_completed)  # 索引から一致するタスクだけを取り出す
+        self.update_badges(selected_tag, show_completed)  # タブの件数表示を更新
+
+        self.visible_tasks = visible_tasks  # 条件に一致するタスクを保持（未表示分は画面に送らない）
+        self.show_tasks(visible_tasks[:limit])  # 表示するページ分に差し替え
+
+    def tab_label(self, label, tag, completed):  # タブの表示名（読み切っていない分は「+」を付ける）
+        n = self.store.count(tag, completed)
+        if self.fully_loaded(tag, completed):
+            return f"{label} ({n})"
+        return f"{label} ({n}+)" if n else label  # まだ読み込んでいないタブは件数を出さない
+
+    def update_badges(self, selected_tag, show_completed):  # タブに件数を表示（索引の件数を読むだけ）
+        for tab, (tag_id, name) in zip(self.tag_tabs.tabs, self.tags):
+            self.ui.set(tab, text=self.tab_label(name, tag_id, show_completed))  # 現在のステータスでのタグ別件数（変わったタブだけ送信）
+        self.ui.set(self.status_tabs.tabs[0], text=self.tab_label("アクティブ", selected_tag, False))
+        self.ui.set(self.status_tabs.tabs[1], text=self.tab_label("完了", selected_tag, True))
+
+    def update_load_more(self):  # 未表示のタスクが残っていれば「もっと見る」を表示
+        remaining = len(self.visible_tasks) - len(self.tasks.controls)
+        if self.search_query:  # 検索結果はDBにまだ続きがあるかで判断
+            self.ui.set(self.load_more_button, visible=remaining > 0 or not self.search_done, text="もっと見る")
+        elif self.fully_loaded(*self.current_filter):
+            self.ui.set(self.load_more_button, visible=remaining > 0, text=f"もっと見る（残り{remaining}件）")
+        else:
+            self.ui.set(self.load_more_button, visible=True, text="もっと見る")  # DBにまだ続きがある
+
+    def load_more(self):  # 次のページ分のタスクを表示に追加
+        shown = len(self.tasks.controls)
+        if self.search_query:  # 検索結果の次のページ
+            self.show_search_results(shown + TASK_PAGE_SIZE)
+            return
+        self.ensure_loaded(*self.current_filter, shown + TASK_PAGE_SIZE)  # 足りない分をDBから読み込む
+        self.visible_tasks = self.store.filter(*self.current_filter)
+        self.update_badges(*self.current_filter)  # 読み込んだ分だけ件数が変わる
+        self.show_tasks(self.visible_tasks[:shown + TASK_PAGE_SIZE])  # 追加分だけ送信される
+
+    def show_tasks(self, tasks):  # 一覧を差し替えて送信（表示するタスクにだけビューを割り当て、外れたビューは送信後に回収）
+        _, removed = self.ui.sync_list(self.tasks, [self.views.get(t) for t in tasks])  # 増減したタスクだけ送信
+        self.update_load_more()  # 「もっと見る」の表示を更新
+        self.ui.commit()  # 変わったコントロールだけを1回で送信
+        self.views.release(removed)
+
+    def load_more_clicked(self, e):  # 「もっと見る」がクリックされたときの処理
+        with self.meter.interaction("load_more_clicked"):
+            self.try_load_more()
+
+    def page_scrolled(self, e):  # ページが下端近くまでスクロールされたら次のページを表示
+        if e.max_scroll_extent is not None and e.pixels >= e.max_scroll_extent - 200:
+            with self.meter.interaction("page_scrolled"):
+                self.try_load_more()
+
+    def try_load_more(self):  # 次のページを表示（読めなければ今の表示のまま知らせる）
+        try:
+            self.load_more()
+        except psycopg2.Error as ex:
+            self.load_failed(ex, lambda: self.load_more_clicked(None))
+
+
+BROWSER_OWNER_RE = re.compile(r"browser:[0-9a-f]{32}")  # resolve_ownerが発行するブラウザごとの識別子の形式
+
+def resolve_owner(page):  # セッションの利用者を決める（ログイン中ならそのユーザー、それ以外はブラウザごとの識別子）
+    if page.auth is not None and page.auth.user is not None:
+        return f"user:{page.auth.user.id}"
+    owner = page.client_storage.get("todo.owner")  # ブラウザに保存した識別子（ブラウザ側で書き換えられるので形式を確かめる）
+    if not isinstance(owner, str) or not BROWSER_OWNER_RE.fullmatch(owner):  # 「user:」などの他人の識別子は受け付けない
+        owner = f"browser:{uuid.uuid4().hex}"
+        page.client_storage.set("todo.owner", owner)  # 次回も同じリストを開けるように保存
+    return owner
 
 def main(page: ft.Page):  # アプリのエントリーポイント
     page.title = "ToDoリスト"  # アプリのタイトル設定
     page.horizontal_alignment = ft.CrossAxisAlignment.CENTER  # 水平方向の中央揃え
     page.scroll = ft.ScrollMode.ADAPTIVE  # スクロールモードを自動調整に設定
+    page.on_scroll_interval = 100  # スクロールイベントの通知間隔（ミリ秒）
+    start_session(page, resolve_owner(page))
 
-    todo_app = TodoApp(page)  # Todoアプリインスタンスを作成
+def start_session(page, owner):  # 利用者のTodoアプリをページに表示し、変更通知の購読を始める（ベンチマークからも使う）
+    todo_app = TodoApp(page, owner)  # Todoアプリインスタンスを作成（利用者のタスクだけを扱う）
     page.todo_app = todo_app  # ページにアプリを紐づけ（後で参照可能に）
-    page.add(todo_app)  # アプリをページに追加して表示
-    todo_app.reload_tasks_from_db()  # DBからタスクを読み込み
-    todo_app.update()  # 画面を更新
+    page.on_scroll = todo_app.page_scrolled  # 下端までスクロールしたら続きを表示
+    page.add(todo_app)  # 入力欄とタブだけの画面を先に表示
+    page.run_thread(todo_app.load_progressively)  # タスクは別スレッドで少しずつ読み込んで順に表示
+
+    token = change_feed.subscribe(todo_app.owner, todo_app.on_remote_changes)  # 同じ利用者の他のセッションの変更を受け取る
+    page.on_close = lambda e: change_feed.unsubscribe(token)  # セッション終了時に購読をやめる
+    return todo_app
+
+def _guess_format(path, fmt):  # 拡張子からファイル形式を決める（指定があればそれを使う）
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".json", ".ndjson")) else "csv"
+
+def run_cli(argv=None):  # コマンドラインの処理（引数なしならアプリを起動）
+    parser = argparse.ArgumentParser(description="タグ付きToDoリスト")
+    sub = parser.add_subparsers(dest="command")
+
+    p_import = sub.add_parser("import", help="CSV/JSON Linesファイルからtodosテーブルへ一括インポート")
+    p_import.add_argument("path", help="入力ファイル（- で標準入力）")
+    p_import.add_argument("--format", choices=["csv", "jsonl"], help="ファイル形式（省略時は拡張子から判定）")
+    p_import.add_argument("--replace", action="store_true", help="既存のタスクを削除してから取り込む")
+    p_import.add_argument("--no-copy", action="store_true", help="COPYではなくexecute_valuesで書き込む")
+    p_import.add_argument("--owner", help="全行をこの所有者のタスクとして取り込む（省略時はファイルのowner列）")
+
+    p_export = sub.add_parser("export", help="todosテーブルをCSV/JSON Linesファイルへ一括エクスポート")
+    p_export.add_argument("path", help="出力ファイル（- で標準出力）")
+    p_export.add_argument("--format", choices=["csv", "jsonl"], help="ファイル形式（省略時は拡張子から判定）")
+    p_export.add_argument("--owner", help="この所有者のタスクだけを書き出す（省略時は全件）")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")  # 他のライブラリは警告以上だけ出す
+    logger.setLevel(LOG_LEVEL)  # アプリのログは情報（保存先・メトリクスの公開先・UI送信量など）も出す
+    ensure_schema()  # 主キー付きのtodosテーブルを用意
+    try:
+        if args.command == "import":
+            fmt = _guess_format(args.path, args.format)
+            fp = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+            with fp:
+                count = import_tasks(fp, fmt, replace=args.replace, use_copy=not args.no_copy, owner=args.owner)
+            print(f"{count}件インポートしました", file=sys.stderr)
+        elif args.command == "export":
+            fmt = _guess_format(args.path, args.format)
+            fp = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8", newline="")
+            with fp:
+                count = export_tasks(fp, fmt, owner=args.owner)
+            print(f"{count}件エクスポートしました", file=sys.stderr)
+        else:
+            if METRICS_PORT:
+                try:
+                    start_metrics_server(METRICS_PORT)  # Fletのポートの隣でメトリクスを公開
+                except OSError as ex:  # ポートが使用中など（メトリクスが無くてもアプリは起動する）
+                    logger.warning("メトリクスのポート%dを開けませんでした: %s", METRICS_PORT, ex)
+            ft.app(target=main, port=APP_PORT, host="0.0.0.0")  # Fletアプリを指定ポートで起動
+    finally:
+        write_behind.drain()  # 保存待ちの変更を書き込んでから
+        close_pool()  # 終了時にプールの接続を閉じる
 
 if __name__ == "__main__":  # このファイルが直接実行された場合
-    ft.app(target=main, port=int(os.environ.get("PORT", 8550)), host="0.0.0.0")  # Fletアプリを指定ポートで起動
+    run_cli()
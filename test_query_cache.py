@@ -0,0 +1,63 @@
+import main as todo
+
+ROWS = ({"id": 1, "name": "タスク1"},)
+
+
+def make_cache(entries=2):  # ROWSをentries件だけ保持できるキャッシュ
+    cache = todo.QueryCache(todo._rows_size(ROWS) * entries)
+    cache.set_enabled(True)
+    return cache
+
+
+def counting_load(calls, key):
+    def load():
+        calls.append(key)
+        return ROWS
+    return load
+
+
+def test_hit_does_not_load_again():
+    cache = make_cache()
+    calls = []
+    assert cache.fetch(("a", 1), counting_load(calls, 1)) == list(ROWS)
+    assert cache.fetch(("a", 1), counting_load(calls, 1)) == list(ROWS)
+    assert calls == [1]
+
+
+def test_evicts_least_recently_used_over_size_cap():
+    cache = make_cache(entries=2)
+    calls = []
+    cache.fetch(("a", 1), counting_load(calls, 1))
+    cache.fetch(("a", 2), counting_load(calls, 2))
+    cache.fetch(("a", 1), counting_load(calls, 1))  # 1を使ったので2が一番古い
+    cache.fetch(("b", 3), counting_load(calls, 3))
+    assert list(cache.entries) == [("a", 1), ("b", 3)]
+    assert cache.size <= cache.max_bytes
+    assert cache.owner_keys == {"a": {("a", 1): None}, "b": {("b", 3): None}}
+    cache.fetch(("a", 2), counting_load(calls, 2))
+    assert calls == [1, 2, 3, 2]
+
+
+def test_invalidated_while_loading_is_not_stored():
+    cache = make_cache()
+    calls = []
+
+    def load():
+        calls.append("load")
+        cache.invalidate("a")  # 読み込み中に書き込み・変更通知が来た
+        return ROWS
+
+    assert cache.fetch(("a", 1), load) == list(ROWS)  # 呼んだセッションには結果を返す
+    assert ("a", 1) not in cache.entries
+    cache.fetch(("a", 1), load)
+    assert calls == ["load", "load"]
+
+
+def test_disabled_cache_always_loads():
+    cache = make_cache()
+    cache.set_enabled(False)  # 変更通知が切れた
+    calls = []
+    cache.fetch(("a", 1), counting_load(calls, 1))
+    cache.fetch(("a", 1), counting_load(calls, 1))
+    assert calls == [1, 1]
+    assert not cache.entries
@@ -0,0 +1,118 @@
+import types
+
+import pytest
+
+import main as todo
+
+CLEAR_SQL = "DELETE FROM todos WHERE owner = %s AND completed"  # clear_clickedが記録する一括削除
+
+
+class FakeCursor:  # 実行された文を記録するだけのカーソル（fail=Trueなら最初の文で失敗する）
+    def __init__(self, log, fail=False):
+        self.log = log
+        self.fail = fail
+
+    def execute(self, sql, params=None):
+        if self.fail:
+            raise RuntimeError("db down")
+        self.log.append("CLEAR" if sql == CLEAR_SQL else sql.split()[0])  # 文の種類だけを記録
+
+
+@pytest.fixture
+def db(monkeypatch):  # DBの代わりに文の実行順を記録する
+    log = []
+    state = {"fail": False, "next_id": 100}
+
+    def execute_values(cur, sql, rows, page_size=None, fetch=False):
+        cur.execute(sql)
+        if fetch:
+            ids = [(state["next_id"] + i,) for i in range(len(rows))]
+            state["next_id"] += len(rows)
+            return ids
+
+    def db_cursor():
+        class Context:
+            def __enter__(self):
+                return FakeCursor(log, state["fail"])
+
+            def __exit__(self, *exc):
+                return False
+        return Context()
+
+    monkeypatch.setattr(todo, "psycopg2", types.SimpleNamespace(extras=types.SimpleNamespace(execute_values=execute_values)))
+    monkeypatch.setattr(todo, "db_cursor", db_cursor)
+    return log, state
+
+
+def make_task(task_id, completed=False):
+    return todo.Task(f"タスク{task_id}", completed=completed, task_id=task_id)
+
+
+def test_row_changes_after_statement_run_after_it(db):
+    log, _ = db
+    changes = todo.TaskChanges("owner")
+    done = make_task(1, completed=True)
+    changes.mark_deleted(done)
+    changes.add_statement(CLEAR_SQL, ("owner",))
+    later = make_task(2)
+    later.completed = True  # 一括削除の後に完了にした
+    changes.mark_dirty(later)
+    changes.flush()
+    assert log == ["DELETE", "CLEAR", "UPDATE"]
+
+
+def test_remarked_row_moves_after_statement(db):
+    log, _ = db
+    changes = todo.TaskChanges("owner")
+    task = make_task(1)
+    changes.mark_dirty(task)
+    changes.add_statement(CLEAR_SQL, ("owner",))
+    task.completed = True
+    changes.mark_dirty(task)  # 同じタスクの変更は最後の1回だけ、一括操作の後で書く
+    assert changes.is_pending(task)
+    changes.flush()
+    assert log == ["CLEAR", "UPDATE"]
+
+
+def test_failed_flush_keeps_order_before_newer_changes(db):
+    log, state = db
+    changes = todo.TaskChanges("owner")
+    before = make_task(1)
+    changes.mark_dirty(before)
+    changes.add_statement(CLEAR_SQL, ("owner",))
+    added = todo.Task("新規")
+    changes.mark_new(added)
+    state["fail"] = True
+    with pytest.raises(RuntimeError):
+        changes.flush()
+    state["fail"] = False
+    later = make_task(2)
+    changes.mark_deleted(later)  # 失敗中に記録された変更は戻した分の後に実行される
+    assert changes.deleted_ids() == {2}
+    saved = changes.flush()
+    assert log == ["UPDATE", "CLEAR", "INSERT", "DELETE"]
+    assert saved == [added] and added.id == 100
+    assert not changes.is_pending(before)
+
+
+def test_rows_being_flushed_stay_pending_until_commit(db, monkeypatch):
+    log, _ = db
+    changes = todo.TaskChanges("owner")
+    added = todo.Task("新規")
+    removed = make_task(7)
+    changes.mark_new(added)
+    changes.mark_deleted(removed)
+    seen = {}
+    execute_values = todo.psycopg2.extras.execute_values
+
+    def observe(cur, sql, rows, page_size=None, fetch=False):  # 保存中（コミット前）の状態を記録
+        seen["saving"] = changes.saving_tasks()
+        seen["deleted"] = changes.deleted_ids()
+        seen["pending"] = changes.is_pending(added)
+        return execute_values(cur, sql, rows, page_size, fetch)
+
+    monkeypatch.setattr(todo.psycopg2.extras, "execute_values", observe)
+    changes.flush()
+    assert seen == {"saving": [added], "deleted": {7}, "pending": True}
+    assert changes.saving_tasks() == [] and changes.deleted_ids() == set()
+    assert added.id == 100
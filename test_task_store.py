@@ -0,0 +1,73 @@
+import types
+
+import main as todo
+
+
+def make_task(task_id, tag_id=None, completed=False):
+    return todo.Task(f"タスク{task_id}", tag_id=tag_id, completed=completed, task_id=task_id)
+
+
+def test_filter_keeps_add_order_after_moves():
+    store = todo.TaskStore()
+    a, b, c = make_task(1, tag_id=1), make_task(2, tag_id=1), make_task(3, tag_id=1)
+    for task in (a, b, c):
+        store.add(task)
+    a.completed = True
+    store.reindex(a)  # 完了にして
+    a.completed = False
+    store.reindex(a)  # 戻すと集合の末尾に入る
+    assert store.unsorted == {(1, False), False}
+    assert store.filter(1, False) == [a, b, c]  # 追加順に並べ直される
+    assert store.filter(todo.ANY_TAG, False) == [a, b, c]
+    assert not store.unsorted
+
+
+def test_appending_in_order_does_not_resort():
+    store = todo.TaskStore()
+    tasks = [make_task(i) for i in range(3)]
+    for task in tasks:
+        store.add(task)
+    assert not store.unsorted
+    assert store.filter(None, False) == tasks
+
+
+def test_last_tasks_stay_after_later_adds():
+    store = todo.TaskStore()
+    saving = todo.Task("保存中")
+    store.add(saving, last=True)  # 読み直し時の未保存のタスク
+    loaded = make_task(1)
+    store.add(loaded)
+    assert store.filter(None, False) == [loaded, saving]
+
+
+def test_count_by_tag_and_status():
+    store = todo.TaskStore()
+    store.add(make_task(1, tag_id=1))
+    store.add(make_task(2, tag_id=1, completed=True))
+    store.add(make_task(3, tag_id=2))
+    other = make_task(4)
+    store.add(other)
+    assert store.count() == 4
+    assert store.count(todo.ANY_TAG, False) == 3
+    assert store.count(1) == 2
+    assert store.count(1, True) == 1
+    assert store.count(None, False) == 1
+    assert store.count(3, False) == 0
+    store.remove(other)
+    assert store.count(None, False) == 0
+    assert store.tags() == {1, 2}
+    assert store.get(4) is None
+
+
+def test_tab_label_marks_partially_loaded_counts():
+    store = todo.TaskStore()
+    store.add(make_task(1, tag_id=1))
+    store.add(make_task(2, tag_id=1))
+    app = types.SimpleNamespace(store=store, cursors={(1, False): {"after": 2, "done": False}})
+    app.fully_loaded = lambda tag, completed: todo.TodoApp.fully_loaded(app, tag, completed)
+    assert todo.TodoApp.tab_label(app, "仕事", 1, False) == "仕事 (2+)"  # まだDBに続きがある
+    assert todo.TodoApp.tab_label(app, "仕事", 1, True) == "仕事"  # まだ読み込んでいない
+    app.cursors[(1, False)]["done"] = True
+    app.cursors[(1, True)] = {"after": None, "done": True}
+    assert todo.TodoApp.tab_label(app, "仕事", 1, False) == "仕事 (2)"
+    assert todo.TodoApp.tab_label(app, "仕事", 1, True) == "仕事 (0)"